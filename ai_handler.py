@@ -1,8 +1,19 @@
-import google.generativeai as genai
-from tenacity import retry, stop_after_attempt, wait_exponential
-from config import GENAI_API_KEY, AI_MODEL, ALT_AI_MODEL, SYSTEM_INSTRUCTION
+import hashlib
+import json
+import re
+import threading
 import time
-from datetime import datetime
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, stop_after_attempt, wait_exponential
+from config import (GENAI_API_KEYS, AI_MODEL, ALT_AI_MODEL, SYSTEM_INSTRUCTION,
+                    AI_RPM, AI_TPM, ALT_AI_RPM, ALT_AI_TPM, AI_BURST,
+                    AI_MAX_INPUT_TOKENS, AI_CHUNK_TOKENS, AI_CHUNK_WORKERS,
+                    AI_BATCH_TOKENS, AI_BATCH_ITEM_TOKENS, AI_BATCH_MAX_VIDEOS)
+from rate_limiter import RateLimiter, estimate_tokens
+from db_operations import get_cached_summary, get_cached_summaries, cache_summary
+from metrics import (timed, ai_rate_limit_wait_seconds, ai_generate_seconds, ai_requests_total,
+                     summary_seconds, summary_cache_total)
 
 class AIError(Exception):
     """Classe base per le eccezioni dell'AI"""
@@ -12,77 +23,365 @@ class ContentTooLongError(AIError):
     """Errore specifico per contenuto troppo lungo"""
     pass
 
-# Configurazione del modello
-genai.configure(api_key=GENAI_API_KEY)
+class BatchParseError(AIError):
+    """Risposta di un riassunto multiplo non conforme al formato JSON richiesto"""
+    pass
+
+def build_model(model_name, key_index, system_instruction=SYSTEM_INSTRUCTION):
+    """Crea un modello legato a una specifica chiave API del pool"""
+    import google.generativeai as genai
+    model = genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction)
+    if key_index > 0:
+        # google-generativeai usa un client globale: per le altre chiavi assegna un client dedicato
+        from google.ai import generativelanguage as glm
+        model._client = glm.GenerativeServiceClient(client_options={"api_key": GENAI_API_KEYS[key_index]})
+    return model
 
-# Dizionario per tenere traccia dei modelli
-models = {
-    'primary': genai.GenerativeModel(model_name=AI_MODEL, 
-                                   system_instruction=SYSTEM_INSTRUCTION),
-    'alternative': genai.GenerativeModel(model_name=ALT_AI_MODEL,
-                                       system_instruction=SYSTEM_INSTRUCTION)
+# Istruzione per i riassunti parziali dei blocchi di una trascrizione lunga
+CHUNK_INSTRUCTION = (
+    "Ricevi una parte di una trascrizione di un video YouTube di calcio. "
+    "Estrai in forma di appunti sintetici tutte le informazioni rilevanti (squadre, giocatori, "
+    "trattative, partite, dichiarazioni), senza introduzioni né conclusioni."
+)
+
+# Nome del modello e istruzione di sistema per ogni ruolo
+model_specs = {
+    'primary': (AI_MODEL, SYSTEM_INSTRUCTION),
+    'alternative': (ALT_AI_MODEL, SYSTEM_INSTRUCTION),
+    'chunk': (AI_MODEL, CHUNK_INSTRUCTION)
 }
+model_names = {role: name for role, (name, _) in model_specs.items()}
+instruction_tokens = {role: estimate_tokens(instruction) for role, (_, instruction) in model_specs.items()}
 
-# Variabile per tenere traccia dell'ultima chiamata
-last_api_call = None
-RATE_LIMIT_DELAY = 65  # 65 secondi di attesa tra le chiamate
+# Istanze dei modelli per ogni chiave API del pool, create al primo utilizzo
+_models = None
+_models_lock = threading.Lock()
 
-def wait_for_rate_limit():
-    """Gestisce il rate limiting per le chiamate API"""
-    global last_api_call
-    
-    if last_api_call is not None:
-        # Calcola quanto tempo è passato dall'ultima chiamata
-        elapsed = (datetime.now() - last_api_call).total_seconds()
-        
-        # Se non è passato abbastanza tempo, aspetta
-        if elapsed < RATE_LIMIT_DELAY:
-            wait_time = RATE_LIMIT_DELAY - elapsed
-            print(f"⏳ Attendo {wait_time:.1f} secondi per rispettare il rate limit di Gemini...")
-            time.sleep(wait_time)
-    
-    # Aggiorna il timestamp dell'ultima chiamata
-    last_api_call = datetime.now()
+def get_models():
+    """Importa e configura google.generativeai e crea i modelli solo alla prima chiamata"""
+    global _models
+    with _models_lock:
+        if _models is None:
+            start = time.perf_counter()
+            import google.generativeai as genai
+            # La prima chiave è quella predefinita della libreria
+            genai.configure(api_key=GENAI_API_KEYS[0] if GENAI_API_KEYS else None)
+            _models = {
+                role: [build_model(name, key_index, instruction)
+                       for key_index in range(max(1, len(GENAI_API_KEYS)))]
+                for role, (name, instruction) in model_specs.items()
+            }
+            print(f"⏱️ Client Gemini inizializzato in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return _models
 
-def try_generate_summary(model, prompt):
+# Rate limiter condiviso: un token bucket per ogni coppia (chiave API, modello)
+rate_limiter = RateLimiter(
+    GENAI_API_KEYS or [None],
+    {
+        AI_MODEL: (AI_RPM, AI_TPM, AI_BURST),
+        ALT_AI_MODEL: (ALT_AI_RPM, ALT_AI_TPM, AI_BURST)
+    }
+)
+
+def acquire_model(role, prompt):
+    """Attende il rate limit del modello e restituisce l'istanza legata alla chiave scelta"""
+    tokens = estimate_tokens(prompt) + instruction_tokens[role]
+    # Tempo di attesa del rate limit, misurato separatamente dal tempo del modello
+    with ai_rate_limit_wait_seconds.time(model=model_names[role]):
+        key_index = rate_limiter.acquire(model_names[role], tokens)
+    return get_models()[role][key_index]
+
+def try_generate_summary(model, prompt, generation_config=None):
     """Tenta di generare un riassunto con un modello specifico"""
+    model_name = getattr(model, "model_name", "sconosciuto")
     try:
-        response = model.generate_content(prompt)
+        with ai_generate_seconds.time(model=model_name):
+            if generation_config:
+                response = model.generate_content(prompt, generation_config=generation_config)
+            else:
+                response = model.generate_content(prompt)
         if not response.text:
             raise AIError("La risposta dell'AI è vuota")
+        ai_requests_total.inc(model=model_name, result="ok")
         return response.text
     except Exception as e:
         error_msg = str(e).lower()
         if "500" in error_msg and "internal error" in error_msg:
             if "context is too long" in error_msg or "reduce your input" in error_msg:
+                ai_requests_total.inc(model=model_name, result="too_long")
                 raise ContentTooLongError("Il contenuto è troppo lungo per questo modello")
+        ai_requests_total.inc(model=model_name, result="error")
         raise
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def _split_oversized(text, max_tokens):
+    """Divide un testo senza confini di frase sugli spazi e, in ultima istanza, con un taglio netto"""
+    max_chars = max(1, (max_tokens - 1) * 4)
+    pieces, current = [], ""
+    for word in text.split():
+        # Parola (o testo senza spazi) più lunga di un blocco: taglio netto dei caratteri
+        for start in range(0, len(word), max_chars):
+            part = word[start:start + max_chars]
+            if current and len(current) + 1 + len(part) > max_chars:
+                pieces.append(current)
+                current = part
+            else:
+                current = f"{current} {part}" if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_transcript(text, max_tokens=AI_CHUNK_TOKENS):
+    """Divide la trascrizione in blocchi di al massimo `max_tokens`, rispettando righe e frasi"""
+    pieces = []
+    for line in text.splitlines():
+        if estimate_tokens(line) <= max_tokens:
+            pieces.append(line)
+            continue
+        # Riga troppo lunga: divide sui confini di frase, poi sugli spazi
+        for sentence in re.split(r'(?<=[.!?])\s+', line):
+            if estimate_tokens(sentence) <= max_tokens:
+                pieces.append(sentence)
+            else:
+                pieces.extend(_split_oversized(sentence, max_tokens))
+
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def summarize_chunk(chunk, title, index, total):
+    """Riassume un singolo blocco della trascrizione in forma di appunti"""
+    prompt = f"""Titolo del video: "{title}". Parte {index} di {total} della trascrizione:
+    {chunk}
+    """
+    return try_generate_summary(acquire_model('chunk', prompt), prompt)
+
+def summarize_in_chunks(text, title):
+    """Riassume una trascrizione lunga: appunti per blocco in parallelo, poi riassunto finale"""
+    notes = text
+    # Ripete la fase di map finché gli appunti non rientrano nella finestra del modello
+    for _ in range(3):
+        if estimate_tokens(notes) + instruction_tokens['primary'] <= AI_MAX_INPUT_TOKENS:
+            break
+        chunks = split_transcript(notes)
+        print(f"✂️ Trascrizione lunga: riassumo {len(chunks)} blocchi separatamente...")
+        with ThreadPoolExecutor(max_workers=max(1, AI_CHUNK_WORKERS)) as executor:
+            partials = list(executor.map(
+                lambda item: summarize_chunk(item[1], title, item[0] + 1, len(chunks)),
+                enumerate(chunks)
+            ))
+        notes = "\n\n".join(partials)
+
+    prompt = f"""Ecco il titolo del video per un maggior contesto: "{title}".     
+    Appunti estratti dalle parti della trascrizione, nell'ordine:
+    {notes}
+    """
+    print("🤖 Generazione del riassunto finale dagli appunti dei blocchi...")
+    return try_generate_summary(acquire_model('primary', prompt), prompt)
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def normalize_transcript(text):
+    """Normalizza la trascrizione (Unicode e spazi) per riconoscere contenuti identici"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+# Versione dei prompt composti nel codice (singolo, a blocchi, multiplo): va incrementata
+# quando cambiano, così come system_prompt.txt cambia PROMPT_HASH
+PROMPT_VERSION = 2
+PROMPT_HASH = _sha256(f"{PROMPT_VERSION}:{SYSTEM_INSTRUCTION}:{CHUNK_INSTRUCTION}")
+
+# Strategie con cui può essere generato un riassunto (salvate con il modello che lo ha prodotto)
+STRATEGY_SINGLE = "single"
+STRATEGY_CHUNKED = "chunked"
+STRATEGY_BATCH = "batch"
+
+def summary_cache_key(text):
+    """Calcola (chiave, hash della trascrizione) per la cache dei riassunti.
+
+    La chiave dipende dai prompt e da entrambi i modelli configurati: cambiandone uno i
+    riassunti precedenti non vengono più riusati.
+    """
+    transcript_hash = _sha256(normalize_transcript(text))
+    return _sha256(f"{transcript_hash}:{PROMPT_HASH}:{AI_MODEL}:{ALT_AI_MODEL}"), transcript_hash
+
+@timed(summary_seconds)
 def get_summary(text, title, video_id=None):
-    """Genera il riassunto tramite Gemini AI con retry e fallback su modello alternativo"""
-    # Applica il rate limiting
-    wait_for_rate_limit()
-    
+    """Restituisce il riassunto dalla cache per contenuto o lo genera tramite Gemini AI.
+
+    Trascrizioni identiche (ricaricamenti, video duplicati) riusano lo stesso riassunto
+    finché istruzione di sistema e modello non cambiano.
+    """
+    cache_key, transcript_hash = summary_cache_key(text)
+    cached_summary = get_cached_summary(cache_key)
+    if cached_summary:
+        print(f"✅ Riassunto trovato nella cache per contenuto ({video_id or title})")
+        summary_cache_total.inc(result="hit")
+        return cached_summary
+    summary_cache_total.inc(result="miss")
+
+    summary, model_name, strategy = generate_summary(text, title, video_id)
+    cache_summary(cache_key, transcript_hash, PROMPT_HASH, model_name, strategy, summary)
+    return summary
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def generate_summary(text, title, video_id=None):
+    """Genera il riassunto tramite Gemini AI con retry e fallback su modello alternativo.
+
+    Restituisce (riassunto, modello che lo ha prodotto, strategia).
+    """
     prompt = f"""Ecco il titolo del video per un maggior contesto: "{title}".     
     Trascrizione:
     {text}
     """
+
+    if estimate_tokens(prompt) + instruction_tokens['primary'] > AI_MAX_INPUT_TOKENS:
+        # Evita una chiamata destinata a fallire: riassume la trascrizione a blocchi
+        try:
+            return summarize_in_chunks(text, title), model_names['primary'], STRATEGY_CHUNKED
+        except Exception as e:
+            print(f"❌ Errore nella generazione del riassunto a blocchi: {str(e)}")
+            raise AIError(f"Errore nella generazione del riassunto a blocchi: {str(e)}")
     
     try:
         # Prima prova con il modello primario
         print("🤖 Tentativo di generazione riassunto con modello primario...")
-        return try_generate_summary(models['primary'], prompt)
+        return (try_generate_summary(acquire_model('primary', prompt), prompt),
+                model_names['primary'], STRATEGY_SINGLE)
     
     except ContentTooLongError:
         # Se il contenuto è troppo lungo, prova con il modello alternativo
         print("⚠️ Contenuto troppo lungo per il modello primario, provo con il modello alternativo...")
         try:
-            return try_generate_summary(models['alternative'], prompt)
+            return (try_generate_summary(acquire_model('alternative', prompt), prompt),
+                    model_names['alternative'], STRATEGY_SINGLE)
         except Exception as e:
             print(f"❌ Errore anche con il modello alternativo: {str(e)}")
             raise AIError(f"Errore nella generazione del riassunto con entrambi i modelli: {str(e)}")
     
     except Exception as e:
         print(f"❌ Errore nella generazione del riassunto AI: {str(e)}")
-        raise AIError(f"Errore nella generazione del riassunto: {str(e)}") 
\ No newline at end of file
+        raise AIError(f"Errore nella generazione del riassunto: {str(e)}") 
+
+def build_batch_prompt(items):
+    """Compone la richiesta per riassumere insieme più video (id, titolo, trascrizione)"""
+    sections = [
+        f"""=== VIDEO {item_id} ===
+    Titolo: "{title}"
+    Trascrizione:
+    {text}"""
+        for item_id, title, text in items
+    ]
+    return (
+        f"Riassumi separatamente ciascuno dei {len(items)} video seguenti, seguendo per ogni riassunto "
+        "le istruzioni di sistema. Non mescolare informazioni di video diversi.\n"
+        'Rispondi solo con un array JSON di oggetti {"id": <id del video>, "summary": <riassunto>}, '
+        "uno per ogni video.\n\n" + "\n\n".join(sections)
+    )
+
+def parse_batch_response(text, expected_ids):
+    """Estrae i riassunti per video dalla risposta JSON; solleva BatchParseError se non valida"""
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        # Risposta racchiusa in un blocco di codice markdown
+        cleaned = cleaned.strip("`")
+        cleaned = cleaned[cleaned.find("["):] if "[" in cleaned else cleaned
+    try:
+        data = json.loads(cleaned)
+    except ValueError as e:
+        raise BatchParseError(f"Risposta non in formato JSON: {str(e)}")
+    if not isinstance(data, list):
+        raise BatchParseError("La risposta non è un array JSON")
+
+    summaries = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        item_id, summary = str(entry.get("id", "")).strip(), entry.get("summary")
+        if item_id in expected_ids and isinstance(summary, str) and summary.strip():
+            summaries[item_id] = summary.strip()
+    return summaries
+
+def is_batchable(title, text):
+    """Indica se una trascrizione è abbastanza breve da essere riassunta insieme ad altre"""
+    return estimate_tokens(text) + estimate_tokens(title) <= AI_BATCH_ITEM_TOKENS
+
+def pack_batches(items, budget=AI_BATCH_TOKENS, max_items=AI_BATCH_MAX_VIDEOS):
+    """Raggruppa le trascrizioni brevi in richieste entro il budget di token (first-fit decrescente)"""
+    batches = []
+    for item in sorted(items, key=lambda item: item[3], reverse=True):
+        for batch in batches:
+            if batch["tokens"] + item[3] <= budget and len(batch["items"]) < max_items:
+                batch["items"].append(item)
+                batch["tokens"] += item[3]
+                break
+        else:
+            batches.append({"items": [item], "tokens": item[3]})
+    return [batch["items"] for batch in batches]
+
+def generate_summary_batch(items):
+    """Riassume più video con un'unica chiamata; restituisce id -> riassunto per quelli riusciti"""
+    prompt = build_batch_prompt([(item_id, title, text) for item_id, title, text, _ in items])
+    print(f"🤖 Generazione di {len(items)} riassunti con un'unica richiesta...")
+    response = try_generate_summary(acquire_model('primary', prompt), prompt,
+                                    generation_config={"response_mime_type": "application/json"})
+    return parse_batch_response(response, {item_id for item_id, _, _, _ in items})
+
+def get_summaries(videos):
+    """Restituisce i riassunti di più video riducendo il numero di richieste a Gemini.
+
+    videos è una lista di (video_id, titolo, trascrizione). Le trascrizioni brevi vengono
+    riassunte insieme in richieste con output JSON per video; le altre, e quelle la cui
+    risposta multipla non è valida, con una richiesta singola. Restituisce
+    video_id -> riassunto oppure l'eccezione che ne ha impedito la generazione.
+    """
+    keys = {video_id: summary_cache_key(text) for video_id, _, text in videos}
+    cached = get_cached_summaries(key for key, _ in keys.values())
+    results = {}
+    short, single = [], []
+    for video_id, title, text in videos:
+        cache_key = keys[video_id][0]
+        if cache_key in cached:
+            summary_cache_total.inc(result="hit")
+            results[video_id] = cached[cache_key]
+            continue
+        summary_cache_total.inc(result="miss")
+        if is_batchable(title, text):
+            short.append((video_id, title, text, estimate_tokens(text) + estimate_tokens(title)))
+        else:
+            single.append((video_id, title, text))
+
+    for batch in pack_batches(short):
+        if len(batch) == 1:
+            single.append(batch[0][:3])
+            continue
+        try:
+            summaries = generate_summary_batch(batch)
+        except Exception as e:
+            print(f"⚠️ Riassunto multiplo non riuscito, riprovo video per video: {str(e)}")
+            summaries = {}
+        for video_id, title, text, _ in batch:
+            if video_id in summaries:
+                results[video_id] = summaries[video_id]
+                cache_key, transcript_hash = keys[video_id]
+                cache_summary(cache_key, transcript_hash, PROMPT_HASH, model_names['primary'], STRATEGY_BATCH,
+                              summaries[video_id])
+            else:
+                single.append((video_id, title, text))
+
+    for video_id, title, text in single:
+        try:
+            summary, model_name, strategy = generate_summary(text, title, video_id)
+            cache_key, transcript_hash = keys[video_id]
+            cache_summary(cache_key, transcript_hash, PROMPT_HASH, model_name, strategy, summary)
+            results[video_id] = summary
+        except Exception as e:
+            results[video_id] = e
+    return results
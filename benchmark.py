@@ -0,0 +1,434 @@
+"""Benchmark del ciclo di polling e processing senza servizi esterni.
+
+Sostituisce YouTube (feed RSS e trascrizioni), Gemini e Telegram con finti servizi locali
+dalla latenza e dal tasso di errore configurabili, genera un carico sintetico (N canali,
+M nuovi video per canale, lunghezze delle trascrizioni log-normali) e misura video al minuto,
+latenza end-to-end p50/p99 e query al database per video.
+
+Serve un PostgreSQL locale configurato con le solite variabili DB_*: le tabelle vengono create
+nello schema separato `benchmark` (ricreato a ogni esecuzione), senza toccare i dati esistenti.
+
+    python benchmark.py --channels 20 --videos 5 --transcript-words 3000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+BENCH_SCHEMA = "benchmark"
+BENCH_TOKEN = "bench"
+BENCH_CHAT_ID = "-100123456"
+BENCH_MODEL = "fake-gemini"
+BENCH_ALT_MODEL = "fake-gemini-long"
+
+VOCABULARY = ("calciomercato trattativa giocatore squadra allenatore contratto prestito riscatto "
+              "attaccante difensore centrocampista partita campionato offerta milioni accordo").split()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark del ciclo di polling e processing con servizi finti")
+    parser.add_argument("--channels", type=int, default=10, help="numero di canali")
+    parser.add_argument("--videos", type=int, default=3, help="nuovi video per canale (massimo 14)")
+    parser.add_argument("--transcript-words", type=int, default=2000, help="lunghezza mediana delle trascrizioni")
+    parser.add_argument("--transcript-sigma", type=float, default=0.6,
+                        help="dispersione (log-normale) della lunghezza delle trascrizioni")
+    parser.add_argument("--rss-latency", type=float, default=0.05, help="latenza dei feed RSS (secondi)")
+    parser.add_argument("--rss-error-rate", type=float, default=0.0, help="frazione di feed in errore (HTTP 500)")
+    parser.add_argument("--transcript-latency", type=float, default=0.2,
+                        help="latenza di ogni richiesta delle trascrizioni (secondi)")
+    parser.add_argument("--transcript-missing-rate", type=float, default=0.05,
+                        help="frazione di video senza trascrizione")
+    parser.add_argument("--transcript-error-rate", type=float, default=0.0,
+                        help="frazione di richieste delle trascrizioni in errore (HTTP 500)")
+    parser.add_argument("--ai-latency", type=float, default=0.5, help="latenza fissa di una chiamata a Gemini")
+    parser.add_argument("--ai-tokens-per-second", type=float, default=20000,
+                        help="token di input elaborati al secondo dal modello finto")
+    parser.add_argument("--ai-context-tokens", type=int, default=32000,
+                        help="token oltre i quali il modello primario restituisce l'errore di contesto troppo lungo")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="latenza dell'API Telegram")
+    parser.add_argument("--telegram-429-rate", type=float, default=0.02,
+                        help="frazione di messaggi rifiutati con HTTP 429")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="processa i video con la pipeline a stadi invece del ciclo singolo")
+    parser.add_argument("--timeout", type=float, default=600, help="tempo massimo della misura (secondi)")
+    parser.add_argument("--seed", type=int, default=42, help="seme del generatore casuale")
+    parser.add_argument("--json", action="store_true", help="stampa il risultato in JSON")
+    return parser.parse_args()
+
+def configure_environment(stub_url):
+    """Punta i client verso i servizi finti.
+
+    URL, credenziali, modelli e metriche vengono sempre sovrascritti, perché la misura deve
+    restare offline; per i limiti di frequenza le variabili già impostate hanno la precedenza.
+    """
+    os.environ["YOUTUBE_FEED_URL"] = f"{stub_url}/feeds/videos.xml"
+    os.environ["YOUTUBE_WATCH_URL"] = f"{stub_url}/watch"
+    os.environ["TELEGRAM_API_URL"] = stub_url
+    os.environ["TELEGRAM_TOKEN"] = BENCH_TOKEN
+    os.environ["TELEGRAM_CHAT_ID"] = BENCH_CHAT_ID
+    os.environ["GENAI_API_KEYS"] = "bench-key"
+    os.environ["AI_MODEL"] = BENCH_MODEL
+    os.environ["ALT_AI_MODEL"] = BENCH_ALT_MODEL
+    os.environ["METRICS_ENABLED"] = "1"
+    # Limiti alti per default, così la misura riguarda il codice e non le quote
+    for name, value in (("AI_RPM", "600"), ("ALT_AI_RPM", "600"), ("AI_BURST", "10"),
+                        ("TELEGRAM_CHAT_RPM", "1200"), ("TELEGRAM_CHAT_BURST", "20"),
+                        ("FAILURE_BASE_DELAY", "0")):
+        os.environ.setdefault(name, value)
+
+class Workload:
+    """Carico sintetico: canali, video e trascrizioni generati in modo deterministico"""
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.channels = {f"Canale {index:03d}": f"UCbench{index:017d}" for index in range(args.channels)}
+        self.phase = "seed"
+        self.videos = {}  # video_id -> (channel_id, titolo, parole, trascrizione disponibile)
+        self.feeds = {}
+        for channel_index, channel_id in enumerate(self.channels.values()):
+            old_video = self._add_video(channel_id, f"b{channel_index:04d}old")
+            new_videos = [self._add_video(channel_id, f"b{channel_index:04d}v{index:02d}")
+                          for index in range(min(args.videos, 14))]
+            # Nel feed il video più recente è il primo
+            self.feeds[channel_id] = {"seed": [old_video], "run": list(reversed(new_videos)) + [old_video]}
+
+    def _add_video(self, channel_id, video_id):
+        words = max(20, int(self.random.lognormvariate(math.log(self.args.transcript_words),
+                                                       self.args.transcript_sigma)))
+        available = self.random.random() >= self.args.transcript_missing_rate
+        self.videos[video_id] = (channel_id, f"Video {video_id}", words, available)
+        return video_id
+
+    @property
+    def measured_videos(self):
+        return [video_id for feed in self.feeds.values() for video_id in feed["run"][:-1]]
+
+    def feed_xml(self, channel_id):
+        entries = []
+        for video_id in self.feeds.get(channel_id, {}).get(self.phase, []):
+            _, title, _, _ = self.videos[video_id]
+            entries.append(f"""
+  <entry>
+    <id>yt:video:{video_id}</id>
+    <yt:videoId>{video_id}</yt:videoId>
+    <yt:channelId>{channel_id}</yt:channelId>
+    <title>{title}</title>
+    <link rel="alternate" href="https://www.youtube.com/watch?v={video_id}"/>
+    <published>2026-01-01T00:00:00+00:00</published>
+  </entry>""")
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">\n'
+                f'  <title>Canale {channel_id}</title>{"".join(entries)}\n</feed>\n')
+
+    def transcript_segments(self, video_id):
+        _, _, words, _ = self.videos[video_id]
+        generator = random.Random(video_id)
+        text = [generator.choice(VOCABULARY) for _ in range(words)]
+        return [{"text": " ".join(text[start:start + 12]) + ".", "start": start / 3, "duration": 4}
+                for start in range(0, words, 12)]
+
+class StubServer(ThreadingHTTPServer):
+    """Servizio HTTP finto per feed RSS, trascrizioni e API di Telegram"""
+
+    daemon_threads = True
+
+    def __init__(self, workload, args):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.workload = workload
+        self.args = args
+        self.random = random.Random(args.seed + 1)
+        self.lock = threading.Lock()
+        self.deliveries = {}  # video_id -> istante dell'ultimo messaggio ricevuto
+        self.messages = 0
+        self.floods = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def chance(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server, url = self.server, urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/feeds/videos.xml":
+            time.sleep(server.args.rss_latency)
+            if server.chance(server.args.rss_error_rate):
+                return self._reply(500, {"error": "feed non disponibile"})
+            return self._reply(200, server.workload.feed_xml(query["channel_id"][0]), "application/atom+xml")
+
+        if url.path in ("/transcripts/list", "/transcripts/fetch"):
+            time.sleep(server.args.transcript_latency)
+            if server.chance(server.args.transcript_error_rate):
+                return self._reply(500, {"error": "errore temporaneo"})
+            video_id = query["video_id"][0]
+            if url.path == "/transcripts/list":
+                return self._reply(200, {"available": server.workload.videos[video_id][3]})
+            return self._reply(200, server.workload.transcript_segments(video_id))
+
+        if url.path == "/watch":
+            # Pagina del video: nel carico sintetico nessun video è una diretta
+            time.sleep(server.args.transcript_latency)
+            return self._reply(200, '{"videoDetails":{"isLiveContent":false}}', "text/html")
+
+        self._reply(404, {"ok": False})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        fields = parse_qs(self.rfile.read(length).decode("utf-8"))
+        time.sleep(server.args.telegram_latency)
+        if self.path.endswith("/sendMessage"):
+            if server.chance(server.args.telegram_429_rate):
+                with server.lock:
+                    server.floods += 1
+                return self._reply(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}})
+            received = time.perf_counter()
+            with server.lock:
+                server.messages += 1
+                for video_id in set(re.findall(r"b\d{4}v\d{2}", fields.get("text", [""])[0])):
+                    server.deliveries[video_id] = received
+        self._reply(200, {"ok": True, "result": {}})
+
+def install_fake_transcript_api(stub_url):
+    """Registra un finto youtube_transcript_api che scarica le trascrizioni dal servizio locale"""
+    import requests
+
+    session_local = threading.local()
+
+    def get(path, video_id):
+        session = getattr(session_local, "session", None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        response = session.get(f"{stub_url}{path}", params={"video_id": video_id}, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    class TranscriptsDisabled(Exception):
+        pass
+
+    class NoTranscriptFound(Exception):
+        pass
+
+    class FakeTranscript:
+        is_generated = False
+        is_translatable = False
+        translation_languages = []
+
+        def __init__(self, video_id):
+            self.video_id = video_id
+
+        def fetch(self):
+            return get("/transcripts/fetch", self.video_id)
+
+    class FakeTranscriptList:
+        def __init__(self, video_id, available):
+            self.transcripts = [FakeTranscript(video_id)] if available else []
+
+        def __iter__(self):
+            return iter(self.transcripts)
+
+        def find_manually_created_transcript(self, languages):
+            if self.transcripts and "it" in languages:
+                return self.transcripts[0]
+            raise NoTranscriptFound()
+
+        def find_generated_transcript(self, languages):
+            raise NoTranscriptFound()
+
+    class YouTubeTranscriptApi:
+        @staticmethod
+        def list_transcripts(video_id):
+            return FakeTranscriptList(video_id, get("/transcripts/list", video_id)["available"])
+
+    class TextFormatter:
+        def format_transcript(self, segments):
+            return "\n".join(segment["text"] for segment in segments)
+
+    module = types.ModuleType("youtube_transcript_api")
+    module.YouTubeTranscriptApi = YouTubeTranscriptApi
+    module.TranscriptsDisabled = TranscriptsDisabled
+    module.NoTranscriptFound = NoTranscriptFound
+    formatters = types.ModuleType("youtube_transcript_api.formatters")
+    formatters.TextFormatter = TextFormatter
+    module.formatters = formatters
+    sys.modules["youtube_transcript_api"] = module
+    sys.modules["youtube_transcript_api.formatters"] = formatters
+
+class FakeGenerativeModel:
+    """Modello finto: latenza proporzionale ai token e errore di contesto oltre il limite"""
+
+    def __init__(self, model_name, args, context_tokens):
+        self.model_name = model_name
+        self.args = args
+        self.context_tokens = context_tokens
+
+    def generate_content(self, prompt, generation_config=None):
+        from rate_limiter import estimate_tokens
+        tokens = estimate_tokens(prompt)
+        if tokens > self.context_tokens:
+            raise Exception("500 Internal error: the input context is too long, reduce your input")
+        time.sleep(self.args.ai_latency + tokens / self.args.ai_tokens_per_second)
+        if generation_config:
+            # Riassunto multiplo: un oggetto JSON per ogni sezione del prompt
+            item_ids = re.findall(r"=== VIDEO (\S+) ===", prompt)
+            return types.SimpleNamespace(text=json.dumps([
+                {"id": item_id, "summary": f"📝 Riassunto di {item_id}: " + "punto. " * 40} for item_id in item_ids
+            ]))
+        video_ids = sorted(set(re.findall(r"b\d{4}v\d{2}", prompt)))
+        return types.SimpleNamespace(text=f"📝 Riassunto di {', '.join(video_ids) or 'un video'}: " + "punto. " * 40)
+
+def install_fake_models(args):
+    """Sostituisce i modelli Gemini con modelli finti per tutti i ruoli"""
+    import ai_handler
+    ai_handler._models = {
+        role: [FakeGenerativeModel(name, args, args.ai_context_tokens if role != 'alternative' else 10 ** 9)]
+        for role, (name, _) in ai_handler.model_specs.items()
+    }
+
+def reset_schema():
+    """Ricrea lo schema del benchmark e indirizza il pool di connessioni su di esso"""
+    import psycopg
+    import config
+    with psycopg.connect(**config.POSTGRES_CONFIG, autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    config.POSTGRES_CONFIG["options"] = f"-c search_path={BENCH_SCHEMA}"
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+def wait_for_pipeline(video_ids, deadline):
+    """Attende che i job dei video misurati lascino la coda (completati o falliti)"""
+    from db_operations import get_connection
+    while time.perf_counter() < deadline:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM job_queue WHERE status = 'pending' AND video_id = ANY(%s)",
+                            (list(video_ids),))
+                if cur.fetchone()[0] == 0:
+                    return True
+        time.sleep(0.5)
+    return False
+
+def run(args):
+    workload = Workload(args)
+    server = StubServer(workload, args)
+    threading.Thread(target=server.serve_forever, name="stub", daemon=True).start()
+    configure_environment(server.url)
+    install_fake_transcript_api(server.url)
+
+    # Import dopo la configurazione: i moduli leggono le variabili d'ambiente all'import
+    reset_schema()
+    import db_operations
+    db_operations.CHANNELS = workload.channels
+    from db_operations import init_db, get_connection, flush_access_stats, close_pool
+    from scheduler import ChannelPollPlan
+    from telegram_handler import outbox
+    from metrics import db_query_seconds
+    import main
+
+    install_fake_models(args)
+    init_db()
+
+    # Primo polling: ogni canale registra il video già esistente (non misurato)
+    main.process_new_videos(main.poll_due_channels(ChannelPollPlan()))
+    outbox.flush()
+    with get_connection() as conn:
+        conn.execute("UPDATE channels SET next_poll_at = NOW()")
+        conn.commit()
+
+    workload.phase = "run"
+    expected = workload.measured_videos
+    _, queries_before = db_query_seconds.totals()
+    with server.lock:
+        server.deliveries.clear()
+        messages_before, floods_before = server.messages, server.floods
+
+    start = time.perf_counter()
+    pipeline = None
+    try:
+        new_videos = main.poll_due_channels(ChannelPollPlan())
+        if args.pipeline:
+            from pipeline import Pipeline, submit_new_video
+            pipeline = Pipeline()
+            pipeline.start()
+            main.enqueue_videos(new_videos, submit_new_video)
+            wait_for_pipeline(expected, start + args.timeout)
+        else:
+            main.process_new_videos(new_videos)
+        outbox.flush()
+    finally:
+        if pipeline:
+            pipeline.stop()
+    elapsed = time.perf_counter() - start
+
+    flush_access_stats()
+    _, queries_after = db_query_seconds.totals()
+    with server.lock:
+        latencies = [server.deliveries[video_id] - start for video_id in expected if video_id in server.deliveries]
+        messages, floods = server.messages - messages_before, server.floods - floods_before
+    outbox.stop()
+    close_pool()
+    server.shutdown()
+
+    processed = len(latencies)
+    return {
+        "mode": "pipeline" if args.pipeline else "single",
+        "channels": args.channels,
+        "videos": len(expected),
+        "videos_delivered": processed,
+        "detected": len(new_videos),
+        "elapsed_seconds": round(elapsed, 3),
+        "videos_per_minute": round(processed / elapsed * 60, 2) if elapsed else None,
+        "latency_p50_seconds": round(percentile(latencies, 0.50), 3) if latencies else None,
+        "latency_p99_seconds": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "db_queries": queries_after - queries_before,
+        "db_queries_per_video": round((queries_after - queries_before) / max(1, len(expected)), 2),
+        "telegram_messages": messages,
+        "telegram_429": floods,
+    }
+
+def main_benchmark():
+    args = parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print("\n📊 Risultati del benchmark")
+        for key, value in result.items():
+            print(f"  {key:<24} {value}")
+
+    # Una pipeline che non rileva o non consegna i video non deve passare per una misura valida
+    if result["detected"] == 0 or result["videos_delivered"] < result["videos"]:
+        print(f"❌ Benchmark non valido: {result['detected']} video rilevati, "
+              f"{result['videos_delivered']} consegnati su {result['videos']}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -4,23 +4,97 @@ from dotenv import load_dotenv
 # Carica le variabili d'ambiente dal file .env
 load_dotenv()
 
-# Configurazione canali YouTube
+# Canali YouTube iniziali: vengono registrati nella tabella channels all'avvio,
+# poi il registro si gestisce dal database (le modifiche valgono senza riavvio)
 CHANNELS = {
     "Alfredo Pedullà": "UC2v9Tfka3PPWDgy_2TXL6Mg",
     "Romeo Agresti": "UCmlXlTE2oTArVL8DafyRsXA",
     "JTalks": "UCg3fYr4L3C5buwo_5EeopuQ"
 }
 
+# Configurazione del polling dei feed RSS
+YOUTUBE_FEED_URL = os.getenv('YOUTUBE_FEED_URL', 'https://www.youtube.com/feeds/videos.xml')
+YOUTUBE_WATCH_URL = os.getenv('YOUTUBE_WATCH_URL', 'https://www.youtube.com/watch')  # Stato di dirette e première
+POLL_MAX_WORKERS = int(os.getenv('POLL_MAX_WORKERS', 8))  # Feed scaricati in parallelo (1 = sequenziale)
+POLL_PER_HOST_LIMIT = int(os.getenv('POLL_PER_HOST_LIMIT', 4))  # Richieste contemporanee verso lo stesso host
+POLL_DEADLINE = float(os.getenv('POLL_DEADLINE', 120))  # Tempo massimo (secondi) per un ciclo di polling
+FEED_TIMEOUT = float(os.getenv('FEED_TIMEOUT', 15))  # Timeout (secondi) della singola richiesta di un feed
+
+# Configurazione delle trascrizioni
+TRANSCRIPT_LANGUAGES = [lang.strip() for lang in os.getenv('TRANSCRIPT_LANGUAGES', 'it,en').split(',') if lang.strip()]
+TRANSCRIPT_WORKERS = int(os.getenv('TRANSCRIPT_WORKERS', 4))  # Trascrizioni scaricate in parallelo
+
+# Dirette e première: la trascrizione viene attesa e aggiornata finché non è stabile
+LIVE_TRACKING = os.getenv('LIVE_TRACKING', '1').lower() not in ('0', 'false', 'no')
+LIVE_TRACK_WINDOW = float(os.getenv('LIVE_TRACK_WINDOW', 21600))  # Solo video visti da meno di questi secondi
+LIVE_MIN_INTERVAL = float(os.getenv('LIVE_MIN_INTERVAL', 300))  # Controllo di una trascrizione che cresce
+LIVE_MAX_INTERVAL = float(os.getenv('LIVE_MAX_INTERVAL', 3600))  # Controllo massimo senza novità
+LIVE_STABLE_POLLS = int(os.getenv('LIVE_STABLE_POLLS', 2))  # Controlli senza nuovi segmenti prima del riassunto
+LIVE_MAX_WAIT = float(os.getenv('LIVE_MAX_WAIT', 172800))  # Attesa massima di una trascrizione (secondi)
+LIVE_POLL_BATCH = int(os.getenv('LIVE_POLL_BATCH', 50))  # Trascrizioni in attesa controllate per ciclo
+
+# Cache negativa dei video senza trascrizione o con riassunto fallito
+FAILURE_BASE_DELAY = float(os.getenv('FAILURE_BASE_DELAY', 1800))  # Attesa dopo il primo fallimento (secondi)
+FAILURE_MAX_DELAY = float(os.getenv('FAILURE_MAX_DELAY', 86400))  # Attesa massima tra due tentativi
+FAILURE_MAX_ATTEMPTS = int(os.getenv('FAILURE_MAX_ATTEMPTS', 6))  # Tentativi prima di abbandonare il video
+
+# Configurazione della modalità daemon
+DAEMON_POLL_TICK = float(os.getenv('DAEMON_POLL_TICK', 60))  # Ogni quanto verificare i canali da interrogare
+DAEMON_SUMMARY_INTERVAL = float(os.getenv('DAEMON_SUMMARY_INTERVAL', 600))  # Video senza trascrizione
+DAEMON_REPROCESS_INTERVAL = float(os.getenv('DAEMON_REPROCESS_INTERVAL', 1800))  # Riassunti falliti
+SCHEDULER_JITTER = float(os.getenv('SCHEDULER_JITTER', 0.1))  # Variazione casuale degli intervalli (frazione)
+CHANNEL_MIN_INTERVAL = float(os.getenv('CHANNEL_MIN_INTERVAL', 300))  # Polling dei canali attivi
+CHANNEL_MAX_INTERVAL = float(os.getenv('CHANNEL_MAX_INTERVAL', 3600))  # Polling dei canali inattivi
+CHANNEL_BACKOFF_FACTOR = float(os.getenv('CHANNEL_BACKOFF_FACTOR', 1.5))  # Crescita dell'intervallo senza novità
+CHANNEL_POLL_BATCH = int(os.getenv('CHANNEL_POLL_BATCH', 200))  # Canali scaduti interrogati per ciclo
+
+# Configurazione della pipeline a stadi (modalità daemon con --pipeline)
+PIPELINE_TRANSCRIPT_WORKERS = int(os.getenv('PIPELINE_TRANSCRIPT_WORKERS', 4))
+PIPELINE_SUMMARY_WORKERS = int(os.getenv('PIPELINE_SUMMARY_WORKERS', 1))
+PIPELINE_NOTIFY_WORKERS = int(os.getenv('PIPELINE_NOTIFY_WORKERS', 2))
+PIPELINE_VISIBILITY_TIMEOUT = float(os.getenv('PIPELINE_VISIBILITY_TIMEOUT', 600))  # Secondi prima che un job in lavorazione torni visibile
+PIPELINE_MAX_ATTEMPTS = int(os.getenv('PIPELINE_MAX_ATTEMPTS', 5))
+PIPELINE_IDLE_WAIT = float(os.getenv('PIPELINE_IDLE_WAIT', 5))  # Attesa dei worker quando la coda è vuota
+PIPELINE_RETENTION_DAYS = int(os.getenv('PIPELINE_RETENTION_DAYS', 7))  # Conservazione dei job completati
+
 # Configurazione Telegram
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
 # Rimuovi eventuali virgolette dall'ID del canale
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID').strip('"').strip("'")
+TELEGRAM_TIMEOUT = float(os.getenv('TELEGRAM_TIMEOUT', 30))  # Timeout (secondi) delle richieste HTTP
+TELEGRAM_CHAT_RPM = float(os.getenv('TELEGRAM_CHAT_RPM', 20))  # Messaggi al minuto per chat (limite di Telegram per canali e gruppi)
+TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', 3))  # Messaggi consecutivi per chat senza attesa
+TELEGRAM_GLOBAL_RPM = float(os.getenv('TELEGRAM_GLOBAL_RPM', 1800))  # Messaggi al minuto complessivi del bot
+TELEGRAM_GLOBAL_BURST = float(os.getenv('TELEGRAM_GLOBAL_BURST', 30))  # Messaggi complessivi senza attesa (30 al secondo per Telegram)
+TELEGRAM_WORKERS = int(os.getenv('TELEGRAM_WORKERS', 4))  # Thread che inviano i messaggi, condivisi tra tutte le chat
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
 
 # Configurazione Gemini AI
 GENAI_API_KEY = os.getenv('GENAI_API_KEY')
+# Pool di chiavi API separate da virgola; se assente si usa la sola GENAI_API_KEY
+GENAI_API_KEYS = [key.strip() for key in os.getenv('GENAI_API_KEYS', GENAI_API_KEY or '').split(',') if key.strip()]
 AI_MODEL = os.getenv('AI_MODEL')
 ALT_AI_MODEL = os.getenv('ALT_AI_MODEL', 'gemini-exp-1206')  # Modello alternativo con fallback
 
+# Budget di rate limit per chiave API (richieste e token al minuto, 0 = nessun limite)
+AI_RPM = float(os.getenv('AI_RPM', 1))
+AI_TPM = float(os.getenv('AI_TPM', 0))
+ALT_AI_RPM = float(os.getenv('ALT_AI_RPM', 1))
+ALT_AI_TPM = float(os.getenv('ALT_AI_TPM', 0))
+AI_BURST = float(os.getenv('AI_BURST', 1))  # Richieste consecutive consentite senza attesa
+
+# Riassunto a blocchi (map-reduce) delle trascrizioni lunghe
+AI_MAX_INPUT_TOKENS = int(os.getenv('AI_MAX_INPUT_TOKENS', 100000))  # Oltre questa soglia si divide la trascrizione
+AI_CHUNK_TOKENS = int(os.getenv('AI_CHUNK_TOKENS', 30000))  # Dimensione massima di ogni blocco
+AI_CHUNK_WORKERS = int(os.getenv('AI_CHUNK_WORKERS', 4))  # Blocchi riassunti in parallelo
+
+# Riassunti di più video brevi in un'unica richiesta
+AI_BATCH_ENABLED = os.getenv('AI_BATCH_ENABLED', '1').lower() not in ('0', 'false', 'no')
+AI_BATCH_TOKENS = int(os.getenv('AI_BATCH_TOKENS', 24000))  # Budget di token di input per richiesta
+AI_BATCH_ITEM_TOKENS = int(os.getenv('AI_BATCH_ITEM_TOKENS', 6000))  # Trascrizioni più lunghe vanno da sole
+AI_BATCH_MAX_VIDEOS = int(os.getenv('AI_BATCH_MAX_VIDEOS', 8))  # Video al massimo per richiesta
+
 # Configurazione Database
 POSTGRES_CONFIG = {
     "host": os.getenv('DB_HOST'),
@@ -30,6 +104,42 @@ POSTGRES_CONFIG = {
     "password": os.getenv('DB_PASSWORD')
 }
 
+# Configurazione del pool di connessioni al database
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # Attesa massima per ottenere una connessione
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))  # Chiude le connessioni inattive oltre questa soglia
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 3600))  # Ricicla le connessioni più vecchie
+CACHE_WRITE_BATCH = int(os.getenv('CACHE_WRITE_BATCH', 20))  # Scritture in cache accumulate prima del salvataggio
+
+# Conservazione della cache delle trascrizioni
+RETENTION_MODE = os.getenv('RETENTION_MODE', 'archive').lower()  # 'archive' (tiene il riassunto) o 'drop'
+RETENTION_TTL_DAYS = int(os.getenv('RETENTION_TTL_DAYS', 90))  # Età massima delle voci (0 = nessun limite)
+RETENTION_MAX_ROWS = int(os.getenv('RETENTION_MAX_ROWS', 0))  # Voci con trascrizione al massimo (0 = nessun limite)
+RETENTION_POLICY = os.getenv('RETENTION_POLICY', 'lru').lower()  # Oltre il limite: 'lru' o 'lfu'
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 200))  # Voci per transazione
+RETENTION_MAX_BATCHES = int(os.getenv('RETENTION_MAX_BATCHES', 50))  # Transazioni al massimo per esecuzione
+RETENTION_LOCK_TIMEOUT = os.getenv('RETENTION_LOCK_TIMEOUT', '200ms')  # Rinuncia invece di attendere i lock
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))  # Frequenza in modalità daemon
+DELIVERY_RETENTION_DAYS = int(os.getenv('DELIVERY_RETENTION_DAYS', 30))  # Conservazione delle consegne Telegram
+DELIVERY_RESEND_AFTER = int(os.getenv('DELIVERY_RESEND_AFTER', 15))  # Minuti dopo cui una consegna in sospeso viene reinviata
+
+# Ricerca testuale su trascrizioni e riassunti
+# Configurazioni di PostgreSQL corrispondenti alle lingue delle trascrizioni (le altre usano 'simple')
+_SEARCH_LANGUAGE_CONFIGS = {'it': 'italian', 'en': 'english', 'es': 'spanish', 'fr': 'french',
+                            'de': 'german', 'pt': 'portuguese', 'nl': 'dutch'}
+SEARCH_CONFIGS = list(dict.fromkeys(_SEARCH_LANGUAGE_CONFIGS.get(lang.split('-')[0].lower(), 'simple')
+                                    for lang in TRANSCRIPT_LANGUAGES)) or ['simple']
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 5))  # Risultati per pagina
+
+# Metriche e log strutturato
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+METRICS_FILE = os.getenv('METRICS_FILE')  # File in formato Prometheus aggiornato periodicamente
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # Porta dell'endpoint HTTP /metrics (0 = disattivato)
+METRICS_WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', 60))  # Aggiornamento di METRICS_FILE
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # DEBUG registra ogni singola osservazione
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # 'text' (chiave=valore) o 'json'
+
 # Carica il prompt di sistema
 try:
     with open("system_prompt.txt", "r", encoding="utf-8") as file:
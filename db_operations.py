@@ -1,78 +1,153 @@
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
 import psycopg
+from psycopg_pool import ConnectionPool, PoolTimeout
 from tenacity import retry, stop_after_attempt, wait_exponential
-from config import POSTGRES_CONFIG
+from config import (CHANNELS, POSTGRES_CONFIG, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+                    DB_POOL_MAX_IDLE, DB_POOL_MAX_LIFETIME, FAILURE_BASE_DELAY, FAILURE_MAX_DELAY,
+                    FAILURE_MAX_ATTEMPTS, METRICS_ENABLED, LIVE_MIN_INTERVAL, SEARCH_CONFIGS)
+from metrics import db_query_seconds
 
 class DatabaseError(Exception):
     """Classe base per le eccezioni del database"""
     pass
 
+def _caller_name():
+    """Nome della funzione che ha eseguito la query, saltando i metodi interni di psycopg"""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get("__name__", "").startswith("psycopg"):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "sconosciuta"
+
+class TimedCursor(psycopg.Cursor):
+    """Cursore che misura la durata di ogni query, etichettata con la funzione chiamante"""
+
+    def execute(self, query, params=None, **kwargs):
+        operation = _caller_name()
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - start, operation=operation)
+
+    def executemany(self, query, params_seq, **kwargs):
+        operation = _caller_name()
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - start, operation=operation)
+
+# Pool di connessioni condiviso, creato al primo utilizzo
+_pool = None
+_pool_lock = threading.Lock()
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def get_connection():
-    """Crea una connessione al database PostgreSQL con retry in caso di errore"""
+def _open_pool():
+    """Apre il pool di connessioni con retry in caso di errore"""
+    pool = ConnectionPool(
+        # Con le metriche disattivate si usa il cursore standard, senza alcun costo aggiuntivo
+        kwargs={**POSTGRES_CONFIG, "cursor_factory": TimedCursor} if METRICS_ENABLED else POSTGRES_CONFIG,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        check=ConnectionPool.check_connection,  # Verifica la connessione prima di consegnarla
+        name="yt_transcript",
+        open=False
+    )
     try:
-        return psycopg.connect(**POSTGRES_CONFIG)
-    except psycopg.Error as e:
+        pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+    except PoolTimeout as e:
+        pool.close()
         raise DatabaseError(f"Errore di connessione al database: {str(e)}")
+    return pool
 
-def init_db():
-    """Crea le tabelle se non esistono"""
-    try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                # Tabella per lo stato dei canali
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS video_state (
-                        channel_id TEXT PRIMARY KEY,
-                        channel_name TEXT NOT NULL,
-                        last_video_id TEXT NOT NULL
-                    )
-                ''')
+def get_pool():
+    """Restituisce il pool di connessioni condiviso, aprendolo se necessario"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = _open_pool()
+        return _pool
 
-                # Verifica se la colonna channel_name esiste già
-                cur.execute('''
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'video_state' AND column_name = 'channel_name'
-                ''')
-                
-                if not cur.fetchone():
-                    # Aggiungi la colonna se non esiste
-                    print("Aggiunta colonna channel_name alla tabella video_state...")
-                    cur.execute('ALTER TABLE video_state ADD COLUMN channel_name TEXT')
-                    cur.execute('UPDATE video_state SET channel_name = \'Unknown\'')
-                    cur.execute('ALTER TABLE video_state ALTER COLUMN channel_name SET NOT NULL')
-
-                # Tabella per la cache delle trascrizioni
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS transcript_cache (
-                        video_id TEXT PRIMARY KEY,
-                        transcript TEXT NOT NULL,
-                        summary TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        updated_at TIMESTAMP DEFAULT NOW(),
-                        access_count INTEGER DEFAULT 0
-                    )
-                ''')
+def close_pool():
+    """Chiude il pool di connessioni condiviso (da chiamare a fine esecuzione)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
 
-                # Indici per migliorare le performance
-                cur.execute('CREATE INDEX IF NOT EXISTS idx_cache_created ON transcript_cache (created_at)')
-                cur.execute('CREATE INDEX IF NOT EXISTS idx_cache_access ON transcript_cache (access_count)')
+def compress_text(text):
+    """Comprime un testo per la memorizzazione come BYTEA"""
+    return zlib.compress(text.encode("utf-8"), 6)
 
-            conn.commit()
+def decompress_text(data):
+    """Decomprime un testo salvato con compress_text"""
+    return zlib.decompress(data).decode("utf-8")
+
+# Configurazioni della colonna generata summary_tsv (i riassunti sono scritti in italiano)
+SUMMARY_SEARCH_CONFIGS = ('italian', 'english')
+
+def tsvector_sql(expression, configs=SEARCH_CONFIGS, weight='B'):
+    """Espressione SQL che indicizza un testo con più configurazioni di ricerca.
+
+    configs proviene da SEARCH_CONFIGS (nomi noti, mai input dell'utente).
+    """
+    return " || ".join(f"setweight(to_tsvector('{config}', COALESCE({expression}, '')), '{weight}')"
+                       for config in configs)
+
+@contextmanager
+def get_connection():
+    """Presta una connessione dal pool; al termine del blocco viene restituita al pool"""
+    try:
+        with get_pool().connection() as conn:
+            yield conn
+    except PoolTimeout as e:
+        raise DatabaseError(f"Nessuna connessione disponibile nel pool: {str(e)}")
+
+def init_db():
+    """Porta lo schema all'ultima versione e registra i canali della configurazione"""
+    # Import locale: migrations dipende da questo modulo
+    from migrations import apply_migrations
+    try:
+        with get_connection() as conn:
+            applied = apply_migrations(conn)
+        if applied:
+            print(f"✅ Applicate {applied} migrazioni dello schema")
+        # A ogni avvio: i canali aggiunti alla configurazione entrano nel registro, quelli già
+        # presenti (anche se disabilitati) restano invariati
+        added = register_channels(CHANNELS)
+        if added:
+            print(f"✅ Registrati {added} nuovi canali dalla configurazione")
     except (psycopg.Error, DatabaseError) as e:
         print(f"❌ Errore durante l'inizializzazione del database: {str(e)}")
         raise
 
 def get_unprocessed_videos():
-    """Recupera i video che sono in video_state ma non hanno una trascrizione in cache"""
+    """Recupera i video segnalati come nuovi che non hanno una trascrizione in cache"""
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('''
-                    SELECT vs.last_video_id, vs.channel_name, vs.channel_id
-                    FROM video_state vs
-                    LEFT JOIN transcript_cache tc ON vs.last_video_id = tc.video_id
-                    WHERE tc.video_id IS NULL
+                    SELECT sv.video_id, vs.channel_name, sv.channel_id, ch.languages, v.title, v.link
+                    FROM seen_videos sv
+                    JOIN video_state vs ON vs.channel_id = sv.channel_id
+                    LEFT JOIN videos v ON v.video_id = sv.video_id
+                    LEFT JOIN channels ch ON ch.channel_id = sv.channel_id
+                    LEFT JOIN transcript_cache tc ON sv.video_id = tc.video_id
+                    LEFT JOIN video_failures vf ON sv.video_id = vf.video_id
+                    LEFT JOIN pending_transcripts pt ON sv.video_id = pt.video_id
+                    WHERE sv.emitted AND tc.video_id IS NULL AND pt.video_id IS NULL
+                      AND (vf.video_id IS NULL OR (NOT vf.gave_up AND vf.next_attempt_at <= NOW()))
+                    ORDER BY sv.first_seen_at
                 ''')
                 results = cur.fetchall()
                 
@@ -81,8 +156,10 @@ def get_unprocessed_videos():
                         "video_id": row[0],
                         "channel_name": row[1],
                         "channel_id": row[2],
-                        "title": f"Video da {row[1]}",  # Titolo generico per retrocompatibilità
-                        "link": f"https://www.youtube.com/watch?v={row[0]}"  # Generiamo il link dal video_id
+                        # Titolo e link generici per i video visti prima della tabella videos
+                        "title": row[4] or f"Video da {row[1]}",
+                        "link": row[5] or f"https://www.youtube.com/watch?v={row[0]}",
+                        "languages": row[3]
                     } for row in results]
                 return []
                 
@@ -90,69 +167,251 @@ def get_unprocessed_videos():
         print(f"❌ Errore nel recupero dei video non processati: {str(e)}")
         return []
 
-def get_last_video_id(channel_id):
-    """Recupera l'ultimo video noto per un dato canale"""
+def get_seen_video_ids(channel_id, video_ids):
+    """Restituisce (il canale ha già video visti, insieme dei video_ids già visti)"""
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT last_video_id FROM video_state WHERE channel_id = %s", (channel_id,))
-                result = cur.fetchone()
-                return result[0] if result else None
+                cur.execute('''
+                    SELECT
+                        EXISTS (SELECT 1 FROM seen_videos WHERE channel_id = %s),
+                        ARRAY(
+                            SELECT video_id FROM seen_videos
+                            WHERE channel_id = %s AND video_id = ANY(%s)
+                        )
+                ''', (channel_id, channel_id, list(video_ids)))
+                has_history, seen = cur.fetchone()
+                return has_history, set(seen)
     except (psycopg.Error, DatabaseError) as e:
-        print(f"❌ Errore nel recupero dell'ultimo video ID: {str(e)}")
+        print(f"❌ Errore nel recupero dei video già visti: {str(e)}")
+        raise
+
+def _parse_published(value):
+    """Converte la data di pubblicazione (ISO, come la produce youtube_handler) in datetime, o None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
         return None
 
-def update_last_video_id(channel_id, video_id, channel_name):
-    """Aggiorna il database con il nuovo video elaborato"""
+def mark_videos_seen(channel_id, channel_name, seen_entries):
+    """Registra i video visti e aggiorna il nome del canale in un'unica transazione.
+
+    seen_entries è una lista di (video, emitted), dove video è la voce del feed RSS:
+    titolo, link e data di pubblicazione vengono salvati nella tabella videos.
+    """
+    videos = [video for video, _ in seen_entries]
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('''
-                    INSERT INTO video_state (channel_id, channel_name, last_video_id)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (channel_id) 
-                    DO UPDATE SET 
-                        last_video_id = EXCLUDED.last_video_id,
-                        channel_name = EXCLUDED.channel_name
-                ''', (channel_id, channel_name, video_id))
+                    INSERT INTO seen_videos (channel_id, video_id, emitted)
+                    SELECT %s, video_id, emitted FROM unnest(%s::text[], %s::boolean[]) AS s(video_id, emitted)
+                    ON CONFLICT DO NOTHING
+                ''', (channel_id, [video["video_id"] for video in videos],
+                      [emitted for _, emitted in seen_entries]))
+                cur.execute('''
+                    INSERT INTO videos (video_id, channel_id, title, link, published_at)
+                    SELECT video_id, %s, title, link, published_at
+                    FROM unnest(%s::text[], %s::text[], %s::text[], %s::timestamptz[])
+                        AS v(video_id, title, link, published_at)
+                    ON CONFLICT DO NOTHING
+                ''', (channel_id, [video["video_id"] for video in videos],
+                      [video.get("title") for video in videos],
+                      [video.get("link") for video in videos],
+                      [_parse_published(video.get("published")) for video in videos]))
+                cur.execute('''
+                    INSERT INTO video_state (channel_id, channel_name)
+                    VALUES (%s, %s)
+                    ON CONFLICT (channel_id)
+                    DO UPDATE SET channel_name = EXCLUDED.channel_name
+                ''', (channel_id, channel_name))
             conn.commit()
     except (psycopg.Error, DatabaseError) as e:
-        print(f"❌ Errore nell'aggiornamento dell'ultimo video ID: {str(e)}")
+        print(f"❌ Errore nella registrazione dei video visti: {str(e)}")
         raise
 
+# Accessi alla cache non ancora registrati nel database (access_count/updated_at)
+_pending_access = Counter()
+_pending_access_lock = threading.Lock()
+
+def _record_cache_access(video_ids):
+    with _pending_access_lock:
+        _pending_access.update(video_ids)
+
+def flush_access_stats():
+    """Registra in un'unica query gli accessi alla cache accumulati"""
+    with _pending_access_lock:
+        pending = dict(_pending_access)
+        _pending_access.clear()
+    if not pending:
+        return
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE transcript_cache tc
+                    SET
+                        access_count = tc.access_count + a.hits,
+                        updated_at = NOW()
+                    FROM unnest(%s::text[], %s::int[]) AS a(video_id, hits)
+                    WHERE tc.video_id = a.video_id
+                ''', (list(pending.keys()), list(pending.values())))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella registrazione degli accessi alla cache: {str(e)}")
+        # Rimette in coda gli accessi per il prossimo tentativo
+        _record_cache_access(pending)
+
 def get_cached_transcript(video_id):
     """Recupera la trascrizione e il riassunto dalla cache"""
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('''
-                    UPDATE transcript_cache 
-                    SET 
-                        access_count = access_count + 1,
-                        updated_at = NOW() 
+                    SELECT transcript_compressed, transcript, summary, summary_status
+                    FROM transcript_cache
                     WHERE video_id = %s
-                    RETURNING transcript, summary
                 ''', (video_id,))
                 result = cur.fetchone()
-                return (result[0], result[1]) if result else (None, None)
+                if not result:
+                    return None, None
+                _record_cache_access([video_id])
+                # La trascrizione viene decompressa solo quando il video viene effettivamente processato
+                transcript = decompress_text(result[0]) if result[0] is not None else result[1]
+                # Un riassunto in errore non è valido: viene restituita solo la trascrizione
+                return transcript, (result[2] if result[3] == 'ok' else None)
     except (psycopg.Error, DatabaseError) as e:
         print(f"❌ Errore nel recupero della trascrizione dalla cache: {str(e)}")
         return None, None
 
-def cache_transcript(video_id, transcript, summary):
-    """Salva la trascrizione e il riassunto nella cache"""
+def get_cache_entries(video_ids):
+    """Recupera con un'unica query lo stato in cache di più video.
+
+    Restituisce video_id -> {"summary": riassunto valido o None, "has_transcript": bool}
+    senza caricare le trascrizioni, che vanno lette con get_cached_transcript solo se servono.
+    """
+    video_ids = list(video_ids)
+    if not video_ids:
+        return {}
     try:
         with get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('''
-                    INSERT INTO transcript_cache (video_id, transcript, summary)
-                    VALUES (%s, %s, %s)
+                    SELECT
+                        video_id,
+                        CASE WHEN summary_status = 'ok' THEN summary END,
+                        transcript_compressed IS NOT NULL OR transcript IS NOT NULL
+                    FROM transcript_cache
+                    WHERE video_id = ANY(%s)
+                ''', (video_ids,))
+                entries = {
+                    row[0]: {"summary": row[1], "has_transcript": row[2]}
+                    for row in cur.fetchall()
+                }
+                _record_cache_access(entries.keys())
+                return entries
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero delle voci dalla cache: {str(e)}")
+        return {}
+
+# Registra un fallimento con attesa esponenziale e abbandono dopo FAILURE_MAX_ATTEMPTS tentativi
+_FAILURE_UPSERT = '''
+    INSERT INTO video_failures AS vf (video_id, reason, attempts, next_attempt_at, gave_up)
+    VALUES (%(video_id)s, %(reason)s, 1, NOW() + make_interval(secs => %(base_delay)s),
+            %(final)s OR 1 >= %(max_attempts)s)
+    ON CONFLICT (video_id)
+    DO UPDATE SET
+        reason = EXCLUDED.reason,
+        attempts = vf.attempts + 1,
+        next_attempt_at = NOW() + make_interval(
+            secs => LEAST(%(base_delay)s * power(2, vf.attempts), %(max_delay)s)
+        ),
+        gave_up = %(final)s OR vf.attempts + 1 >= %(max_attempts)s,
+        last_failed_at = NOW()
+    RETURNING attempts, gave_up
+'''
+
+def _failure_params(video_id, reason, final=False):
+    return {
+        "video_id": video_id,
+        "reason": reason,
+        "final": final,
+        "base_delay": FAILURE_BASE_DELAY,
+        "max_delay": FAILURE_MAX_DELAY,
+        "max_attempts": FAILURE_MAX_ATTEMPTS
+    }
+
+def record_video_failure(video_id, reason, final=False):
+    """Registra un tentativo fallito per il video e restituisce (tentativi, abbandonato).
+
+    Con final=True il fallimento è definitivo e il video non viene più ritentato.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_FAILURE_UPSERT, _failure_params(video_id, reason, final))
+                attempts, gave_up = cur.fetchone()
+            conn.commit()
+            if gave_up:
+                print(f"🚫 Video {video_id} abbandonato dopo {attempts} tentativi ({reason})")
+            return attempts, gave_up
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella registrazione del fallimento del video {video_id}: {str(e)}")
+        return None, False
+
+def cache_transcript(video_id, transcript, summary, summary_status='ok', summary_key=None):
+    """Salva la trascrizione e il riassunto nella cache"""
+    cache_transcripts([(video_id, transcript, summary, summary_status, summary_key)])
+
+def cache_transcripts(entries):
+    """Salva in un'unica istruzione più trascrizioni e riassunti.
+
+    entries: sequenza di (video_id, transcript, summary, summary_status, summary_key);
+    in caso di video ripetuti prevale l'ultima voce.
+    """
+    latest = {entry[0]: entry for entry in entries}
+    if not latest:
+        return
+    rows = list(latest.values())
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # La trascrizione è salvata compressa: il vettore di ricerca si calcola dal testo in chiaro
+                cur.execute(f'''
+                    INSERT INTO transcript_cache
+                        (video_id, transcript_compressed, transcript, transcript_tsv,
+                         summary, summary_status, summary_key)
+                    SELECT video_id, transcript_compressed, NULL, {tsvector_sql('transcript_text')},
+                           summary, summary_status, summary_key
+                    FROM unnest(%s::text[], %s::bytea[], %s::text[], %s::text[], %s::text[], %s::text[])
+                        AS e(video_id, transcript_compressed, transcript_text, summary, summary_status, summary_key)
                     ON CONFLICT (video_id) 
                     DO UPDATE SET
-                        transcript = EXCLUDED.transcript,
+                        transcript_compressed = EXCLUDED.transcript_compressed,
+                        transcript = NULL,
+                        transcript_tsv = EXCLUDED.transcript_tsv,
                         summary = EXCLUDED.summary,
+                        summary_status = EXCLUDED.summary_status,
+                        summary_key = EXCLUDED.summary_key,
+                        archived_at = NULL,
                         updated_at = NOW()
-                ''', (video_id, transcript, summary))
+                ''', (
+                    [row[0] for row in rows],
+                    [compress_text(row[1]) for row in rows],
+                    [row[1] for row in rows],
+                    [row[2] for row in rows],
+                    [row[3] for row in rows],
+                    [row[4] for row in rows]
+                ))
+                # Un riassunto riuscito azzera la cache negativa, uno fallito la aggiorna
+                ok_ids = [row[0] for row in rows if row[3] == 'ok']
+                if ok_ids:
+                    cur.execute("DELETE FROM video_failures WHERE video_id = ANY(%s)", (ok_ids,))
+                failed = [_failure_params(row[0], "summary_error") for row in rows if row[3] != 'ok']
+                if failed:
+                    cur.executemany(_FAILURE_UPSERT, failed)
             conn.commit()
     except (psycopg.Error, DatabaseError) as e:
         print(f"❌ Errore nel salvataggio della trascrizione nella cache: {str(e)}")
@@ -164,11 +423,17 @@ def get_videos_to_reprocess():
         with get_connection() as conn:
             with conn.cursor() as cur:
                 # Recupera i video che hanno una trascrizione ma un riassunto con errore
+                # (solo i metadati: la trascrizione viene caricata al momento del processing)
                 cur.execute('''
-                    SELECT tc.video_id, tc.transcript, vs.channel_name, vs.channel_id
+                    SELECT tc.video_id, COALESCE(vs.channel_name, ch.name, 'Unknown'), v.channel_id,
+                           ch.languages, v.title, v.link
                     FROM transcript_cache tc
-                    JOIN video_state vs ON tc.video_id = vs.last_video_id
-                    WHERE tc.summary LIKE '⚠️ Riassunto non disponibile%'
+                    JOIN videos v ON v.video_id = tc.video_id
+                    LEFT JOIN video_state vs ON vs.channel_id = v.channel_id
+                    LEFT JOIN channels ch ON ch.channel_id = v.channel_id
+                    LEFT JOIN video_failures vf ON tc.video_id = vf.video_id
+                    WHERE tc.summary_status = 'error'
+                      AND (vf.video_id IS NULL OR (NOT vf.gave_up AND vf.next_attempt_at <= NOW()))
                     ORDER BY tc.updated_at DESC
                 ''')
                 results = cur.fetchall()
@@ -176,14 +441,512 @@ def get_videos_to_reprocess():
                 if results:
                     return [{
                         "video_id": row[0],
-                        "transcript": row[1],
-                        "channel_name": row[2],
-                        "channel_id": row[3],
-                        "title": f"Video da {row[2]}",  # Titolo generico
-                        "link": f"https://www.youtube.com/watch?v={row[0]}"  # Link generato dal video_id
+                        "channel_name": row[1],
+                        "channel_id": row[2],
+                        # Titolo e link generici per i video visti prima della tabella videos
+                        "title": row[4] or f"Video da {row[1]}",
+                        "link": row[5] or f"https://www.youtube.com/watch?v={row[0]}",
+                        "languages": row[3]
                     } for row in results]
                 return []
                 
     except (psycopg.Error, DatabaseError) as e:
         print(f"❌ Errore nel recupero dei video da riprocessare: {str(e)}")
-        return [] 
\ No newline at end of file
+        return []
+
+def get_feed_states():
+    """Recupera lo stato HTTP (ETag, Last-Modified, hash) di tutti i feed noti"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT channel_id, etag, last_modified, content_hash FROM feed_state")
+                return {
+                    row[0]: {"etag": row[1], "last_modified": row[2], "content_hash": row[3]}
+                    for row in cur.fetchall()
+                }
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero dello stato dei feed: {str(e)}")
+        return {}
+
+def save_feed_states(states):
+    """Salva in un'unica transazione lo stato HTTP dei feed aggiornati"""
+    if not states:
+        return
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany('''
+                    INSERT INTO feed_state (channel_id, etag, last_modified, content_hash)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (channel_id)
+                    DO UPDATE SET
+                        etag = EXCLUDED.etag,
+                        last_modified = EXCLUDED.last_modified,
+                        content_hash = EXCLUDED.content_hash,
+                        updated_at = NOW()
+                ''', [
+                    (channel_id, state.get("etag"), state.get("last_modified"), state.get("content_hash"))
+                    for channel_id, state in states.items()
+                ])
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel salvataggio dello stato dei feed: {str(e)}")
+
+def get_cached_summary(cache_key):
+    """Recupera un riassunto valido dalla cache indicizzata per contenuto"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE summary_cache SET hit_count = hit_count + 1
+                    WHERE cache_key = %s AND status = 'ok'
+                    RETURNING summary
+                ''', (cache_key,))
+                result = cur.fetchone()
+            conn.commit()
+            return result[0] if result else None
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero del riassunto dalla cache: {str(e)}")
+        return None
+
+def get_cached_summaries(cache_keys):
+    """Recupera con un'unica query i riassunti validi in cache per più chiavi"""
+    cache_keys = list(dict.fromkeys(cache_keys))
+    if not cache_keys:
+        return {}
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE summary_cache SET hit_count = hit_count + 1
+                    WHERE cache_key = ANY(%s) AND status = 'ok'
+                    RETURNING cache_key, summary
+                ''', (cache_keys,))
+                results = dict(cur.fetchall())
+            conn.commit()
+            return results
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero dei riassunti dalla cache: {str(e)}")
+        return {}
+
+def cache_summary(cache_key, transcript_hash, prompt_hash, model_name, strategy, summary):
+    """Salva un riassunto generato con successo nella cache indicizzata per contenuto.
+
+    model_name e strategy sono quelli che hanno effettivamente prodotto il riassunto.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO summary_cache (cache_key, transcript_hash, prompt_hash, model_name, strategy, summary)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (cache_key)
+                    DO UPDATE SET
+                        prompt_hash = EXCLUDED.prompt_hash,
+                        model_name = EXCLUDED.model_name,
+                        strategy = EXCLUDED.strategy,
+                        summary = EXCLUDED.summary,
+                        status = 'ok',
+                        created_at = NOW()
+                ''', (cache_key, transcript_hash, prompt_hash, model_name, strategy, summary))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        # La cache è un'ottimizzazione: un errore di scrittura non blocca il riassunto
+        print(f"❌ Errore nel salvataggio del riassunto nella cache: {str(e)}")
+
+def invalidate_summaries(prompt_hash=None, model_name=None, strategy=None):
+    """Invalida i riassunti in cache generati con un certo prompt, modello e/o strategia"""
+    if prompt_hash is None and model_name is None and strategy is None:
+        raise ValueError("Specificare almeno prompt_hash, model_name o strategy")
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE summary_cache SET status = 'stale'
+                    WHERE status = 'ok'
+                      AND (%(prompt_hash)s::text IS NULL OR prompt_hash = %(prompt_hash)s)
+                      AND (%(model_name)s::text IS NULL OR model_name = %(model_name)s)
+                      AND (%(strategy)s::text IS NULL OR strategy = %(strategy)s)
+                ''', {"prompt_hash": prompt_hash, "model_name": model_name, "strategy": strategy})
+                invalidated = cur.rowcount
+            conn.commit()
+            return invalidated
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'invalidazione dei riassunti in cache: {str(e)}")
+        raise
+
+def get_subscribers(channel_id):
+    """Recupera le chat iscritte a un canale"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT chat_id FROM subscriptions WHERE channel_id = %s ORDER BY created_at",
+                            (channel_id,))
+                return [row[0] for row in cur.fetchall()]
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero degli iscritti del canale {channel_id}: {str(e)}")
+        raise
+
+def add_subscription(chat_id, channel_id):
+    """Iscrive una chat a un canale; restituisce False se era già iscritta"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO subscriptions (chat_id, channel_id) VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING
+                ''', (str(chat_id), channel_id))
+                added = cur.rowcount > 0
+            conn.commit()
+            return added
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'iscrizione della chat {chat_id}: {str(e)}")
+        raise
+
+def remove_subscription(chat_id, channel_id):
+    """Annulla l'iscrizione di una chat a un canale"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM subscriptions WHERE chat_id = %s AND channel_id = %s",
+                            (str(chat_id), channel_id))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella disiscrizione della chat {chat_id}: {str(e)}")
+        raise
+
+def reserve_deliveries(video_id, chat_ids, kinds):
+    """Registra le consegne previste per il video e restituisce quelle non ancora inviate.
+
+    Le consegne già inviate (ad esempio prima di un crash) non vengono restituite,
+    così la ripresa del fan-out non invia messaggi doppi.
+    """
+    pairs = [(str(chat_id), kind) for chat_id in chat_ids for kind in kinds]
+    if not pairs:
+        return set()
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO deliveries (video_id, chat_id, kind)
+                    SELECT %s, chat_id, kind FROM unnest(%s::text[], %s::text[]) AS d(chat_id, kind)
+                    ON CONFLICT DO NOTHING
+                ''', (video_id, [pair[0] for pair in pairs], [pair[1] for pair in pairs]))
+                cur.execute('''
+                    SELECT chat_id, kind FROM deliveries
+                    WHERE video_id = %s AND status <> 'sent'
+                      AND chat_id = ANY(%s) AND kind = ANY(%s)
+                ''', (video_id, list({pair[0] for pair in pairs}), list(kinds)))
+                pending = {(row[0], row[1]) for row in cur.fetchall()}
+            conn.commit()
+            return pending
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella registrazione delle consegne per {video_id}: {str(e)}")
+        raise
+
+def mark_delivery_sent(video_id, chat_id, kind):
+    """Segna come inviata una consegna"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE deliveries SET status = 'sent', sent_at = NOW()
+                    WHERE video_id = %s AND chat_id = %s AND kind = %s
+                ''', (video_id, str(chat_id), kind))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'aggiornamento della consegna per {video_id}: {str(e)}")
+
+def get_stale_deliveries(older_than_minutes):
+    """Recupera le consegne rimaste in sospeso da più di `older_than_minutes` minuti.
+
+    Sono le consegne di un invio interrotto (crash, arresto) che nessuno ha più in coda.
+    Restituisce per ognuna i dati del video e il riassunto in cache, se ancora valido.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT d.video_id, d.chat_id, d.kind, v.channel_id, v.title, v.link,
+                           COALESCE(vs.channel_name, ch.name, 'Unknown'),
+                           CASE WHEN tc.summary_status = 'ok' THEN tc.summary END
+                    FROM deliveries d
+                    LEFT JOIN videos v ON v.video_id = d.video_id
+                    LEFT JOIN video_state vs ON vs.channel_id = v.channel_id
+                    LEFT JOIN channels ch ON ch.channel_id = v.channel_id
+                    LEFT JOIN transcript_cache tc ON tc.video_id = d.video_id
+                    WHERE d.status <> 'sent' AND d.created_at < NOW() - make_interval(mins => %s)
+                    ORDER BY d.created_at, d.video_id, d.chat_id
+                ''', (older_than_minutes,))
+                return [{
+                    "video_id": video_id,
+                    "chat_id": chat_id,
+                    "kind": kind,
+                    "channel_id": channel_id,
+                    "channel_name": channel_name,
+                    "title": title or f"Video da {channel_name}",
+                    "link": link or f"https://www.youtube.com/watch?v={video_id}",
+                    "summary": summary,
+                } for video_id, chat_id, kind, channel_id, title, link, channel_name, summary in cur.fetchall()]
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero delle consegne in sospeso: {str(e)}")
+        raise
+
+def get_latest_summary(channel_id):
+    """Recupera l'ultimo video del canale con un riassunto valido in cache"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT sv.video_id, tc.summary
+                    FROM seen_videos sv
+                    JOIN transcript_cache tc ON tc.video_id = sv.video_id
+                    WHERE sv.channel_id = %s AND sv.emitted AND tc.summary_status = 'ok'
+                    ORDER BY sv.first_seen_at DESC
+                    LIMIT 1
+                ''', (channel_id,))
+                result = cur.fetchone()
+                return (result[0], result[1]) if result else (None, None)
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero dell'ultimo riassunto del canale {channel_id}: {str(e)}")
+        return None, None
+
+def register_channels(channels):
+    """Registra i canali della configurazione (nome -> id) senza modificare quelli già presenti.
+
+    Restituisce il numero di canali aggiunti.
+    """
+    if not channels:
+        return 0
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO channels (channel_id, name)
+                    SELECT channel_id, name FROM unnest(%s::text[], %s::text[]) AS c(channel_id, name)
+                    ON CONFLICT DO NOTHING
+                ''', (list(channels.values()), list(channels.keys())))
+                added = cur.rowcount
+            conn.commit()
+            return added
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella registrazione dei canali: {str(e)}")
+        raise
+
+def add_channel(channel_id, name, languages=None, priority=0):
+    """Aggiunge o riattiva un canale nel registro; viene interrogato al prossimo ciclo"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO channels (channel_id, name, languages, priority)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (channel_id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        languages = EXCLUDED.languages,
+                        priority = EXCLUDED.priority,
+                        enabled = TRUE,
+                        next_poll_at = NOW(),
+                        updated_at = NOW()
+                ''', (channel_id, name, languages or None, priority))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'aggiunta del canale {channel_id}: {str(e)}")
+        raise
+
+def set_channel_enabled(channel_id, enabled):
+    """Abilita o disabilita il polling di un canale"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE channels SET enabled = %s, updated_at = NOW() WHERE channel_id = %s",
+                            (enabled, channel_id))
+                found = cur.rowcount > 0
+            conn.commit()
+            return found
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'aggiornamento del canale {channel_id}: {str(e)}")
+        raise
+
+def claim_due_channels(limit, lease):
+    """Preleva i canali da interrogare, in ordine di priorità e di scadenza.
+
+    La prossima scadenza dei canali prelevati viene spostata avanti di `lease` secondi:
+    se il polling si interrompe vengono ripresi più tardi, e processi concorrenti non
+    interrogano lo stesso canale. Legge solo i canali scaduti tramite l'indice parziale.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    WITH due AS (
+                        SELECT channel_id FROM channels
+                        WHERE enabled AND next_poll_at <= NOW()
+                        ORDER BY priority DESC, next_poll_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE channels c
+                    SET next_poll_at = NOW() + make_interval(secs => %s)
+                    FROM due
+                    WHERE c.channel_id = due.channel_id
+                    RETURNING c.channel_id, c.name, c.languages, c.poll_interval, c.error_streak
+                ''', (limit, lease))
+                rows = cur.fetchall()
+            conn.commit()
+            return [{
+                "channel_id": row[0],
+                "name": row[1],
+                "languages": row[2],
+                "poll_interval": row[3],
+                "error_streak": row[4]
+            } for row in rows]
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero dei canali da interrogare: {str(e)}")
+        return []
+
+def record_channel_polls(results):
+    """Salva con un'unica istruzione l'esito del polling dei canali.
+
+    results è una lista di (channel_id, intervallo, errori consecutivi, attesa in secondi).
+    """
+    if not results:
+        return
+    channel_ids, intervals, error_streaks, delays = (list(column) for column in zip(*results))
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE channels c SET
+                        poll_interval = r.poll_interval,
+                        error_streak = r.error_streak,
+                        last_polled_at = NOW(),
+                        next_poll_at = NOW() + make_interval(secs => r.delay),
+                        updated_at = NOW()
+                    FROM unnest(%s::text[], %s::real[], %s::int[], %s::float8[])
+                        AS r(channel_id, poll_interval, error_streak, delay)
+                    WHERE c.channel_id = r.channel_id
+                ''', (channel_ids, intervals, error_streaks, delays))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel salvataggio dello stato dei canali: {str(e)}")
+
+def track_pending_transcript(video_id, window):
+    """Mette in attesa la trascrizione di un video visto da meno di `window` secondi.
+
+    Restituisce True se il video è (o era già) in attesa, False se è troppo vecchio.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO pending_transcripts (video_id, next_check_at)
+                    SELECT video_id, NOW() + make_interval(secs => %s) FROM videos
+                    WHERE video_id = %s AND first_seen_at > NOW() - make_interval(secs => %s)
+                    ON CONFLICT DO NOTHING
+                ''', (LIVE_MIN_INTERVAL, video_id, window))
+                cur.execute("SELECT 1 FROM pending_transcripts WHERE video_id = %s", (video_id,))
+                tracked = cur.fetchone() is not None
+            conn.commit()
+            return tracked
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella registrazione della trascrizione in attesa per {video_id}: {str(e)}")
+        return False
+
+def claim_pending_transcripts(limit, lease):
+    """Preleva le trascrizioni in attesa da controllare, con i metadati dei video.
+
+    Come per i canali, la scadenza viene spostata avanti di `lease` secondi perché processi
+    concorrenti non controllino lo stesso video.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    WITH due AS (
+                        SELECT video_id FROM pending_transcripts
+                        WHERE next_check_at <= NOW()
+                        ORDER BY next_check_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE pending_transcripts pt
+                    SET next_check_at = NOW() + make_interval(secs => %s)
+                    FROM due
+                    WHERE pt.video_id = due.video_id
+                    RETURNING pt.video_id, pt.segment_count, pt.last_segment_start, pt.stable_polls,
+                              pt.polls, EXTRACT(EPOCH FROM NOW() - pt.created_at)
+                ''', (limit, lease))
+                rows = cur.fetchall()
+                if not rows:
+                    conn.commit()
+                    return []
+                cur.execute('''
+                    SELECT v.video_id, v.channel_id, v.title, v.link,
+                           COALESCE(vs.channel_name, ch.name, 'Unknown'), ch.languages
+                    FROM videos v
+                    LEFT JOIN video_state vs ON vs.channel_id = v.channel_id
+                    LEFT JOIN channels ch ON ch.channel_id = v.channel_id
+                    WHERE v.video_id = ANY(%s)
+                ''', ([row[0] for row in rows],))
+                videos = {row[0]: row for row in cur.fetchall()}
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel recupero delle trascrizioni in attesa: {str(e)}")
+        return []
+
+    pending = []
+    for video_id, segment_count, last_segment_start, stable_polls, polls, age in rows:
+        video = videos.get(video_id)
+        if video is None:
+            continue
+        pending.append({
+            "video": {
+                "video_id": video_id,
+                "channel_id": video[1],
+                "title": video[2] or f"Video da {video[4]}",
+                "link": video[3] or f"https://www.youtube.com/watch?v={video_id}",
+                "channel_name": video[4],
+                "languages": video[5]
+            },
+            "segment_count": segment_count,
+            "last_segment_start": last_segment_start,
+            "stable_polls": stable_polls,
+            "polls": polls,
+            "age": float(age)
+        })
+    return pending
+
+def update_pending_transcript(video_id, appended_text, segment_count, last_segment_start, stable_polls, delay):
+    """Aggiunge in coda solo il testo dei nuovi segmenti e pianifica il prossimo controllo"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE pending_transcripts SET
+                        transcript = transcript || %s,
+                        segment_count = %s,
+                        last_segment_start = %s,
+                        stable_polls = %s,
+                        polls = polls + 1,
+                        next_check_at = NOW() + make_interval(secs => %s),
+                        updated_at = NOW()
+                    WHERE video_id = %s
+                ''', (appended_text, segment_count, last_segment_start, stable_polls, delay, video_id))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'aggiornamento della trascrizione in attesa per {video_id}: {str(e)}")
+
+def pop_pending_transcript(video_id):
+    """Rimuove il video dall'attesa e restituisce la trascrizione accumulata"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM pending_transcripts WHERE video_id = %s RETURNING transcript",
+                            (video_id,))
+                result = cur.fetchone()
+            conn.commit()
+            return result[0] if result else None
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella rimozione della trascrizione in attesa per {video_id}: {str(e)}")
+        raise
@@ -0,0 +1,130 @@
+from config import TELEGRAM_CHAT_ID, DELIVERY_RESEND_AFTER
+from db_operations import (get_subscribers, add_subscription, reserve_deliveries, mark_delivery_sent,
+                           get_latest_summary, get_stale_deliveries)
+from telegram_handler import (TelegramError, outbox, format_video_message,
+                              format_missing_summary_message)
+
+# Tipi di consegna tracciati per ogni coppia (video, chat)
+KIND_ANNOUNCE = "announce"
+KIND_SUMMARY = "summary"
+KIND_MISSING = "missing"
+
+def get_recipients(channel_id):
+    """Restituisce la chat predefinita seguita dalle chat iscritte al canale"""
+    default_chat = [str(TELEGRAM_CHAT_ID)] if TELEGRAM_CHAT_ID else []
+    return list(dict.fromkeys(default_chat + get_subscribers(channel_id)))
+
+def fan_out(video_info, messages):
+    """Consegna i messaggi di un video a tutte le chat iscritte al suo canale.
+
+    messages è una lista di coppie (tipo, testo), inviate in ordine a ogni chat. Le consegne
+    già avvenute vengono saltate, così un fan-out interrotto riprende senza messaggi doppi.
+    Restituisce i Future dei gruppi accodati nell'outbox (uno per chat).
+    """
+    video_id = video_info["video_id"]
+    recipients = get_recipients(video_info["channel_id"])
+    pending = reserve_deliveries(video_id, recipients, [kind for kind, _ in messages])
+
+    futures = []
+    for chat_id in recipients:
+        group = [(kind, text) for kind, text in messages if (str(chat_id), kind) in pending]
+        if not group:
+            continue
+
+        def on_sent(index, chat_id=chat_id, group=group):
+            mark_delivery_sent(video_id, chat_id, group[index][0])
+
+        futures.append(outbox.submit([text for _, text in group], chat_id, on_sent))
+    return futures
+
+def wait_for_deliveries(futures):
+    """Attende i gruppi accodati e rilancia il primo errore di invio"""
+    errors = [future.exception() for future in futures]
+    errors = [error for error in errors if error is not None]
+    if errors:
+        raise TelegramError(f"Invio fallito verso {len(errors)} chat su {len(futures)}: {str(errors[0])}")
+
+def announce_video(video_info):
+    """Invia solo la notifica del video (il riassunto seguirà quando disponibile)"""
+    try:
+        fan_out(video_info, [(KIND_ANNOUNCE, format_video_message(video_info))])
+    except Exception as e:
+        print(f"❌ Errore generico nella notifica del video: {str(e)}")
+
+def process_new_video(video_info, transcript=None, summary=None):
+    """Processa un nuovo video e accoda le notifiche per tutte le chat iscritte"""
+    try:
+        # Notifica nuovo video
+        messages = [(KIND_ANNOUNCE, format_video_message(video_info))]
+
+        # Se abbiamo un riassunto, invialo
+        if summary:
+            messages.append((KIND_SUMMARY, summary))
+        elif transcript is None:
+            messages.append((KIND_MISSING, format_missing_summary_message(video_info)))
+            print(f"⏩ Saltato il riassunto per {video_info['title']} (trascrizione non disponibile)")
+
+        fan_out(video_info, messages)
+
+    except Exception as e:
+        print(f"❌ Errore generico nel processing del video: {str(e)}")
+        # Non rilanciamo l'errore per permettere al programma di continuare
+
+def _delivery_text(delivery):
+    """Ricompone il testo di una consegna in sospeso (None se il riassunto non è più in cache)"""
+    if delivery["kind"] == KIND_ANNOUNCE:
+        return format_video_message(delivery)
+    if delivery["kind"] == KIND_SUMMARY:
+        return delivery["summary"]
+    return format_missing_summary_message(delivery)
+
+def resend_pending_deliveries(older_than_minutes=DELIVERY_RESEND_AFTER):
+    """Reinvia le consegne rimaste in sospeso dopo un invio interrotto (crash, arresto).
+
+    Va eseguito prima della pulizia delle consegne, che altrimenti le eliminerebbe senza
+    averle mai inviate. Le consegne più recenti della soglia possono essere ancora in coda
+    nell'outbox e vengono lasciate stare. Restituisce i Future dei gruppi accodati.
+    """
+    order = [KIND_ANNOUNCE, KIND_SUMMARY, KIND_MISSING]
+    groups = {}
+    try:
+        for delivery in get_stale_deliveries(older_than_minutes):
+            text = _delivery_text(delivery)
+            if text is None:
+                print(f"⚠️ Riassunto di {delivery['video_id']} non più in cache: consegna non reinviabile")
+                continue
+            groups.setdefault((delivery["video_id"], delivery["chat_id"]), []).append((delivery["kind"], text))
+    except Exception as e:
+        print(f"❌ Errore nel recupero delle consegne in sospeso: {str(e)}")
+        return []
+
+    futures = []
+    for (video_id, chat_id), group in groups.items():
+        group.sort(key=lambda message: order.index(message[0]))
+
+        def on_sent(index, video_id=video_id, chat_id=chat_id, group=group):
+            mark_delivery_sent(video_id, chat_id, group[index][0])
+
+        futures.append(outbox.submit([text for _, text in group], chat_id, on_sent))
+    if futures:
+        print(f"📨 Reinvio delle consegne in sospeso verso {len(futures)} coppie video-chat")
+    return futures
+
+def subscribe(chat_id, channel_id):
+    """Iscrive una chat a un canale e le invia l'ultimo riassunto già disponibile.
+
+    Il riassunto viene letto dalla cache: un nuovo iscritto costa un solo messaggio,
+    senza scaricare trascrizioni né chiamare Gemini.
+    """
+    chat_id = str(chat_id)
+    if not add_subscription(chat_id, channel_id):
+        print(f"ℹ️ La chat {chat_id} è già iscritta al canale {channel_id}")
+        return None
+
+    print(f"✅ Chat {chat_id} iscritta al canale {channel_id}")
+    video_id, summary = get_latest_summary(channel_id)
+    if not summary or not reserve_deliveries(video_id, [chat_id], [KIND_SUMMARY]):
+        return None
+
+    return outbox.submit([summary], chat_id,
+                         lambda _: mark_delivery_sent(video_id, chat_id, KIND_SUMMARY))
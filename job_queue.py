@@ -0,0 +1,128 @@
+import psycopg
+from psycopg.types.json import Jsonb
+from config import PIPELINE_MAX_ATTEMPTS, PIPELINE_RETENTION_DAYS
+from db_operations import get_connection, DatabaseError
+
+class Job:
+    """Job della pipeline prelevato dalla coda"""
+
+    def __init__(self, job_id, stage, video_id, payload, attempts, max_attempts):
+        self.id = job_id
+        self.stage = stage
+        self.video_id = video_id
+        self.payload = payload
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+    @property
+    def is_last_attempt(self):
+        return self.attempts >= self.max_attempts
+
+def _enqueue(cur, stage, video_id, payload, delay=0, max_attempts=PIPELINE_MAX_ATTEMPTS):
+    """Inserisce un job; un job già concluso per lo stesso stadio e video viene riattivato"""
+    cur.execute('''
+        INSERT INTO job_queue (stage, video_id, payload, max_attempts, available_at)
+        VALUES (%s, %s, %s, %s, NOW() + make_interval(secs => %s))
+        ON CONFLICT (stage, video_id)
+        DO UPDATE SET
+            payload = EXCLUDED.payload,
+            status = 'pending',
+            attempts = 0,
+            max_attempts = EXCLUDED.max_attempts,
+            available_at = EXCLUDED.available_at,
+            last_error = NULL,
+            updated_at = NOW()
+        WHERE job_queue.status <> 'pending'
+    ''', (stage, video_id, Jsonb(payload), max_attempts, delay))
+
+def enqueue_job(stage, video_id, payload, delay=0):
+    """Accoda un job per uno stadio della pipeline"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                _enqueue(cur, stage, video_id, payload, delay)
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nell'accodamento del job {stage} per {video_id}: {str(e)}")
+        raise
+
+def claim_job(stage, visibility_timeout):
+    """Preleva il prossimo job pronto per lo stadio.
+
+    Il job resta 'pending' ma diventa invisibile per `visibility_timeout` secondi: se il
+    worker termina in modo anomalo, il job torna disponibile e nessun lavoro va perso.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE job_queue
+                    SET
+                        attempts = attempts + 1,
+                        available_at = NOW() + make_interval(secs => %s),
+                        updated_at = NOW()
+                    WHERE id = (
+                        SELECT id FROM job_queue
+                        WHERE stage = %s AND status = 'pending' AND available_at <= NOW()
+                        ORDER BY available_at
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, stage, video_id, payload, attempts, max_attempts
+                ''', (visibility_timeout, stage))
+                row = cur.fetchone()
+            conn.commit()
+            return Job(*row) if row else None
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel prelievo di un job {stage}: {str(e)}")
+        return None
+
+def complete_job(job, next_stage=None, next_payload=None):
+    """Segna il job come completato e accoda lo stadio successivo nella stessa transazione"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE job_queue SET status = 'done', last_error = NULL, updated_at = NOW()
+                    WHERE id = %s
+                ''', (job.id,))
+                if next_stage:
+                    _enqueue(cur, next_stage, job.video_id, next_payload or {})
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nel completamento del job {job.stage} per {job.video_id}: {str(e)}")
+        raise
+
+def fail_job(job, error, retry_delay):
+    """Registra il fallimento del job: lo ripianifica o lo segna come fallito definitivamente"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    UPDATE job_queue
+                    SET
+                        status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                        available_at = NOW() + make_interval(secs => %s),
+                        last_error = %s,
+                        updated_at = NOW()
+                    WHERE id = %s
+                ''', (retry_delay, str(error), job.id))
+            conn.commit()
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella registrazione del fallimento del job {job.stage}: {str(e)}")
+
+def purge_finished_jobs(retention_days=PIPELINE_RETENTION_DAYS):
+    """Elimina i job completati più vecchi della soglia di conservazione"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    DELETE FROM job_queue
+                    WHERE status = 'done' AND updated_at < NOW() - make_interval(days => %s)
+                ''', (retention_days,))
+                deleted = cur.rowcount
+            conn.commit()
+            return deleted
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella pulizia della coda dei job: {str(e)}")
+        return 0
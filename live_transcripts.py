@@ -0,0 +1,96 @@
+from config import (LIVE_TRACKING, LIVE_TRACK_WINDOW, LIVE_MIN_INTERVAL, LIVE_MAX_INTERVAL,
+                    LIVE_STABLE_POLLS, LIVE_MAX_WAIT, LIVE_POLL_BATCH, POLL_DEADLINE)
+from db_operations import (track_pending_transcript, claim_pending_transcripts, update_pending_transcript,
+                           pop_pending_transcript, record_video_failure)
+from youtube_handler import LIVE_UPCOMING, LIVE_STREAM, get_transcript_segments, get_live_status
+from fanout import process_new_video
+
+# Esiti di handle_missing_transcript
+MISSING_PENDING = "pending"  # Diretta o première in attesa: va notificato solo il video
+MISSING_NOTIFY = "notify"  # Assenza del riassunto da notificare
+MISSING_NOTIFIED = "notified"  # Assenza già notificata in un tentativo precedente
+
+def track_video(video_info):
+    """Mette in attesa la trascrizione di una diretta o première appena pubblicata.
+
+    Restituisce True se il video verrà ricontrollato, False se non è recente.
+    """
+    tracked = track_pending_transcript(video_info["video_id"], LIVE_TRACK_WINDOW)
+    if tracked:
+        print(f"⏳ Trascrizione non ancora disponibile per {video_info.get('title', video_info['video_id'])}: "
+              "verrà ricontrollata finché non è completa")
+    return tracked
+
+def handle_missing_transcript(video_info):
+    """Gestisce un video senza trascrizione (sottotitoli disattivati o assenti).
+
+    Solo le dirette e le première recenti vengono messe in attesa. Negli altri casi il video
+    entra nella cache negativa con attesa esponenziale: i sottotitoli automatici di un video
+    normale possono arrivare in ritardo, e FAILURE_MAX_ATTEMPTS decide quando rinunciare.
+    """
+    video_id = video_info["video_id"]
+    if LIVE_TRACKING:
+        try:
+            live_status = get_live_status(video_id)
+            if live_status in (LIVE_UPCOMING, LIVE_STREAM) and track_video(video_info):
+                return MISSING_PENDING
+        except Exception as e:
+            print(f"⚠️ Impossibile verificare se {video_id} è una diretta: {str(e)}")
+
+    attempts, _ = record_video_failure(video_id, "no_transcript")
+    # La notifica parte solo al primo tentativo, non a ogni nuovo controllo
+    return MISSING_NOTIFY if attempts is None or attempts <= 1 else MISSING_NOTIFIED
+
+def next_delay(stable_polls):
+    """Attesa esponenziale tra i controlli di una trascrizione che non cambia"""
+    return min(LIVE_MIN_INTERVAL * 2 ** stable_polls, LIVE_MAX_INTERVAL)
+
+def give_up(video_info):
+    """Rinuncia ad attendere la trascrizione: il video passa alla cache negativa"""
+    print(f"⏩ Trascrizione mai arrivata per {video_info['title']}, smetto di attenderla")
+    record_video_failure(video_info["video_id"], "no_transcript", final=True)
+    process_new_video(video_info)
+
+def check_pending_transcripts():
+    """Controlla le trascrizioni in attesa scadute e restituisce i video pronti per il riassunto.
+
+    Dei segmenti scaricati vengono salvati solo quelli successivi all'ultimo già memorizzato.
+    Una trascrizione è pronta quando resta invariata per LIVE_STABLE_POLLS controlli; i video
+    restituiti contengono la chiave "transcript" e vanno processati come gli altri.
+    """
+    ready = []
+    for entry in claim_pending_transcripts(LIVE_POLL_BATCH, POLL_DEADLINE):
+        video_info = entry["video"]
+        video_id = video_info["video_id"]
+        try:
+            segments = get_transcript_segments(video_id, video_info.get("languages"))
+        except Exception as e:
+            print(f"⚠️ Errore nel controllo della trascrizione in attesa per {video_id}: {str(e)}")
+            update_pending_transcript(video_id, "", entry["segment_count"], entry["last_segment_start"],
+                                      entry["stable_polls"], next_delay(entry["stable_polls"]))
+            continue
+
+        new_segments = [(start, text) for start, text in segments or [] if start > entry["last_segment_start"]]
+        if new_segments:
+            appended = "\n".join(text for _, text in new_segments)
+            if entry["segment_count"]:
+                appended = "\n" + appended
+            update_pending_transcript(video_id, appended, entry["segment_count"] + len(new_segments),
+                                      new_segments[-1][0], 0, LIVE_MIN_INTERVAL)
+            print(f"📝 {len(new_segments)} nuovi segmenti di trascrizione per {video_info['title']}")
+            continue
+
+        stable_polls = entry["stable_polls"] + 1
+        expired = entry["age"] >= LIVE_MAX_WAIT
+        if segments and (stable_polls >= LIVE_STABLE_POLLS or expired):
+            transcript = pop_pending_transcript(video_id)
+            if transcript:
+                print(f"✅ Trascrizione completa per {video_info['title']}")
+                ready.append({**video_info, "transcript": transcript})
+        elif expired:
+            pop_pending_transcript(video_id)
+            give_up(video_info)
+        else:
+            update_pending_transcript(video_id, "", entry["segment_count"], entry["last_segment_start"],
+                                      stable_polls, next_delay(stable_polls))
+    return ready
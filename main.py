@@ -1,33 +1,90 @@
-from db_operations import (init_db, get_cached_transcript, cache_transcript, 
-                        get_videos_to_reprocess, get_unprocessed_videos)
-from youtube_handler import poll_channels, get_transcript
-from telegram_handler import process_new_video, check_bot_status
-from ai_handler import get_summary
-
-def process_video_with_cache(video_info):
-    """Processa un video utilizzando la cache quando possibile"""
+import argparse
+import time
+_process_start = time.perf_counter()
+from db_operations import (init_db, get_cached_transcript, get_cache_entries, cache_transcripts,
+                        get_videos_to_reprocess, get_unprocessed_videos, flush_access_stats, close_pool,
+                        add_channel, set_channel_enabled, invalidate_summaries, record_video_failure)
+from youtube_handler import poll_channels, get_transcript, get_transcripts
+from telegram_handler import check_bot_status, outbox
+from fanout import process_new_video, announce_video, subscribe, resend_pending_deliveries
+from live_transcripts import handle_missing_transcript, check_pending_transcripts, MISSING_PENDING, MISSING_NOTIFY
+from ai_handler import AIError, get_summary, get_summaries, summary_cache_key, is_batchable
+from scheduler import Scheduler, ChannelPollPlan
+from pipeline import Pipeline, submit_new_video, submit_video_for_processing
+from job_queue import purge_finished_jobs
+from retention import apply_retention, purge_deliveries
+from search import search_videos, format_search_results, SearchError
+from metrics import transcript_cache_total, start_http_server, write_textfile
+from config import (DAEMON_POLL_TICK, DAEMON_SUMMARY_INTERVAL, DAEMON_REPROCESS_INTERVAL, CACHE_WRITE_BATCH,
+                    METRICS_FILE, METRICS_WRITE_INTERVAL, AI_BATCH_ENABLED, AI_BATCH_MAX_VIDEOS,
+                    RETENTION_INTERVAL)
+
+# Tempo speso per importare i moduli (le librerie pesanti vengono caricate al primo utilizzo)
+IMPORT_TIME = time.perf_counter() - _process_start
+
+def flush_cache_writes(pending_writes):
+    """Salva in un'unica istruzione le voci di cache accumulate"""
+    if pending_writes:
+        cache_transcripts(pending_writes)
+        pending_writes.clear()
+
+def store_in_cache(entry, pending_writes=None):
+    """Salva subito una voce di cache, oppure la accoda se è attivo un buffer di scrittura"""
+    if pending_writes is None:
+        cache_transcripts([entry])
+        return
+    pending_writes.append(entry)
+    if len(pending_writes) >= CACHE_WRITE_BATCH:
+        flush_cache_writes(pending_writes)
+
+def process_video_with_cache(video_info, cache_entry=None, pending_writes=None):
+    """Processa un video utilizzando la cache quando possibile.
+
+    cache_entry è la voce già letta con get_cache_entries ({} se il video non è in cache);
+    se assente viene letta qui. Con pending_writes le scritture in cache vengono accodate.
+    """
     video_id = video_info["video_id"]
     
     # Prova a recuperare dalla cache
-    cached_transcript, cached_summary = get_cached_transcript(video_id)
+    if cache_entry is None:
+        cache_entry = get_cache_entries([video_id]).get(video_id, {})
     
-    if cached_transcript and cached_summary:
-        # Se il riassunto non contiene un errore
-        if not cached_summary.startswith("⚠️ Riassunto non disponibile"):
-            print(f"✅ Usando dati dalla cache per {video_info.get('title', video_id)}")
-            process_new_video(video_info, cached_transcript, cached_summary)
-            return True
+    # Il riassunto è presente solo se valido (stato 'ok'), anche se la trascrizione è archiviata
+    if cache_entry.get("summary"):
+        print(f"✅ Usando dati dalla cache per {video_info.get('title', video_id)}")
+        transcript_cache_total.inc(result="hit")
+        process_new_video(video_info, None, cache_entry["summary"])
+        return True
+    if cache_entry.get("has_transcript"):
+        transcript_cache_total.inc(result="stale")
         print(f"⚠️ Riassunto in cache non valido per {video_info.get('title', video_id)}, riprovo...")
-    
-    # Se non in cache o riassunto non valido, scarica e processa
-    transcript = video_info.get("transcript") or (get_transcript(video_id)[0] if not cached_transcript else cached_transcript)
+    else:
+        transcript_cache_total.inc(result="miss")
+
+    # Se non in cache o riassunto non valido, carica la trascrizione salvata o scaricala
+    # (la chiave "transcript" presente indica che il download è già stato tentato)
+    transcript = video_info.get("transcript")
+    if not transcript and cache_entry.get("has_transcript"):
+        transcript = get_cached_transcript(video_id)[0]
+    if not transcript and "transcript" not in video_info:
+        try:
+            transcript = get_transcript(video_id, video_info.get("languages"))[0]
+        except Exception:
+            # Video privato, rimosso o errore temporaneo: il video viene ritentato con attesa
+            # esponenziale invece di bloccare a ogni esecuzione i video non processati
+            record_video_failure(video_id, "transcript_error")
+            raise
     
     if transcript:
         try:
-            # Prova a generare il riassunto
-            summary = get_summary(transcript, video_info.get("title", "Video senza titolo"), video_id)
+            # Usa il riassunto già generato in una richiesta multipla, altrimenti lo genera
+            if "summary_error" in video_info:
+                raise AIError(video_info["summary_error"])
+            summary = (video_info.get("summary")
+                       or get_summary(transcript, video_info.get("title", "Video senza titolo"), video_id))
             # Salva trascrizione e riassunto in cache
-            cache_transcript(video_id, transcript, summary)
+            store_in_cache((video_id, transcript, summary, 'ok', summary_cache_key(transcript)[0]),
+                           pending_writes)
             # Processa il video con entrambi
             process_new_video(video_info, transcript, summary)
             return True
@@ -35,27 +92,102 @@ def process_video_with_cache(video_info):
             print(f"❌ Errore nel generare il riassunto per {video_info.get('title', video_id)}: {str(e)}")
             # Salva solo la trascrizione con un messaggio di errore come riassunto
             error_summary = f"⚠️ Riassunto non disponibile a causa di un errore: {str(e)}"
-            cache_transcript(video_id, transcript, error_summary)
+            store_in_cache((video_id, transcript, error_summary, 'error', None), pending_writes)
             # Invia la notifica del video con la trascrizione ma senza riassunto
             process_new_video(video_info, transcript, None)
             return False
     else:
-        # Se non c'è trascrizione, invia solo la notifica del video
-        process_new_video(video_info)
+        outcome = handle_missing_transcript(video_info)
+        if outcome == MISSING_PENDING:
+            # Diretta o première appena pubblicata: notifica il video e attende la trascrizione
+            announce_video(video_info)
+        elif outcome == MISSING_NOTIFY:
+            process_new_video(video_info)
         return True
 
+def summarize_in_batches(videos, cache_entries):
+    """Genera insieme i riassunti mancanti delle trascrizioni brevi già in memoria.
+
+    Le trascrizioni lunghe e quelle da rileggere dalla cache restano al percorso singolo di
+    process_video_with_cache; i video riassunti ricevono la chiave "summary" (o "summary_error").
+    """
+    candidates = [
+        video for video in videos
+        if video.get("transcript") and not cache_entries.get(video["video_id"], {}).get("summary")
+        and is_batchable(video.get("title", "Video senza titolo"), video["transcript"])
+    ]
+    if len(candidates) < 2:
+        return videos
+
+    try:
+        results = get_summaries([
+            (video["video_id"], video.get("title", "Video senza titolo"), video["transcript"])
+            for video in candidates
+        ])
+    except Exception as e:
+        # I video verranno riassunti singolarmente da process_video_with_cache
+        print(f"❌ Errore nella generazione dei riassunti multipli: {str(e)}")
+        return videos
+    summarized = {}
+    for video in candidates:
+        result = results.get(video["video_id"])
+        if isinstance(result, Exception):
+            summarized[video["video_id"]] = {**video, "summary_error": str(result)}
+        elif result:
+            summarized[video["video_id"]] = {**video, "summary": result}
+    return [summarized.get(video["video_id"], video) for video in videos]
+
+def process_videos(videos, on_success=None, error_label="processare"):
+    """Processa una lista di video con un'unica lettura della cache e scritture accodate"""
+    cache_entries = get_cache_entries(video["video_id"] for video in videos)
+
+    # Scarica in parallelo le trascrizioni dei video che non le hanno in cache
+    to_fetch = {
+        video["video_id"] for video in videos
+        if "transcript" not in video and not any(
+            cache_entries.get(video["video_id"], {}).get(field) for field in ("has_transcript", "summary"))
+    }
+    if to_fetch:
+        transcripts = get_transcripts(
+            to_fetch, languages={video["video_id"]: video.get("languages") for video in videos}
+        )
+        # I video in errore restano senza chiave "transcript" e verranno ritentati singolarmente
+        videos = [
+            {**video, "transcript": transcripts[video["video_id"]]} if video["video_id"] in transcripts else video
+            for video in videos
+        ]
+
+    # Con i riassunti multipli i video procedono a finestre: le notifiche di ogni finestra
+    # partono prima di generare i riassunti della successiva
+    window = max(1, AI_BATCH_MAX_VIDEOS if AI_BATCH_ENABLED else len(videos))
+    pending_writes = []
+    try:
+        for start in range(0, len(videos), window):
+            batch = videos[start:start + window]
+            if AI_BATCH_ENABLED:
+                batch = summarize_in_batches(batch, cache_entries)
+            for video in batch:
+                try:
+                    processed = process_video_with_cache(video, cache_entries.get(video["video_id"], {}),
+                                                         pending_writes)
+                    if processed and on_success:
+                        on_success(video)
+                except Exception as e:
+                    print(f"❌ Errore nel {error_label} il video {video['video_id']}: {str(e)}")
+    finally:
+        flush_cache_writes(pending_writes)
+        flush_access_stats()
+
 def process_pending_videos():
     """Processa i video che necessitano di essere riprocessati"""
     pending_videos = get_videos_to_reprocess()
     if pending_videos:
         print(f"🔄 Trovati {len(pending_videos)} video da riprocessare...")
-        for video in pending_videos:
-            try:
-                print(f"🔄 Riprocesso video {video['video_id']}...")
-                if process_video_with_cache(video):
-                    print(f"✅ Video {video['video_id']} riprocessato con successo")
-            except Exception as e:
-                print(f"❌ Errore nel riprocessare il video {video['video_id']}: {str(e)}")
+        process_videos(
+            pending_videos,
+            on_success=lambda video: print(f"✅ Video {video['video_id']} riprocessato con successo"),
+            error_label="riprocessare"
+        )
     return bool(pending_videos)
 
 def process_unprocessed_videos():
@@ -63,46 +195,251 @@ def process_unprocessed_videos():
     unprocessed = get_unprocessed_videos()
     if unprocessed:
         print(f"🔄 Trovati {len(unprocessed)} video senza trascrizione...")
-        for video in unprocessed:
-            try:
-                print(f"🔄 Processo video {video['video_id']}...")
-                process_video_with_cache(video)
-            except Exception as e:
-                print(f"❌ Errore nel processare il video {video['video_id']}: {str(e)}")
+        process_videos(unprocessed)
         return True
     return False
 
+def process_ready_transcripts():
+    """Riassume le trascrizioni in attesa (dirette e première) diventate complete"""
+    ready = check_pending_transcripts()
+    if ready:
+        process_videos(ready)
+    return bool(ready)
+
+def process_new_videos(new_videos):
+    """Processa i nuovi video trovati dal polling"""
+    if new_videos:
+        process_videos(new_videos, error_label="processing del")
+
+def poll_due_channels(poll_plan):
+    """Interroga solo i canali scaduti del registro e aggiorna la loro pianificazione"""
+    due = poll_plan.due_channels()
+    if not due:
+        return []
+    failed = []
+    new_videos = poll_channels(due, failed)
+    poll_plan.record_poll([channel_id for _, channel_id in due],
+                          {video["channel_id"] for video in new_videos}, set(failed))
+    for video in new_videos:
+        video["languages"] = poll_plan.languages(video["channel_id"])
+    return new_videos
+
+def setup():
+    """Verifica le credenziali Telegram e inizializza il database"""
+    start = time.perf_counter()
+    # Verifica le credenziali Telegram
+    if not check_bot_status():
+        print("❌ Impossibile procedere: errore nella verifica delle credenziali Telegram")
+        return False
+    telegram_time = time.perf_counter() - start
+        
+    # Inizializza il database se necessario
+    init_db()
+    db_time = time.perf_counter() - start - telegram_time
+    start_http_server()
+
+    print(f"⏱️ Avvio: import {IMPORT_TIME * 1000:.0f} ms, verifica Telegram {telegram_time * 1000:.0f} ms, "
+          f"database {db_time * 1000:.0f} ms")
+    return True
+
+def clean_up_deliveries():
+    """Reinvia le consegne rimaste in sospeso, poi elimina quelle più vecchie della soglia"""
+    resend_pending_deliveries()
+    purge_deliveries()
+
 def main_single_run():
     """Avvia il monitoraggio e processa i nuovi video"""
     try:
-        # Verifica le credenziali Telegram
-        if not check_bot_status():
-            print("❌ Impossibile procedere: errore nella verifica delle credenziali Telegram")
+        if not setup():
             return
-            
-        # Inizializza il database se necessario
-        init_db()
+
+        # Completa le trascrizioni in attesa diventate stabili
+        process_ready_transcripts()
         
         # Prima controlla se ci sono video senza trascrizione
         if not process_unprocessed_videos():
             # Poi controlla se ci sono video da riprocessare
             if not process_pending_videos():
-                # Se non ci sono video da riprocessare, controlla nuovi video
-                new_videos = poll_channels()
+                # Se non ci sono video da riprocessare, controlla i canali scaduti
+                new_videos = poll_due_channels(ChannelPollPlan())
                 
                 # Processa ogni nuovo video
-                for video_info in new_videos:
-                    try:
-                        process_video_with_cache(video_info)
-                    except Exception as e:
-                        print(f"❌ Errore nel processing del video {video_info['title']}: {str(e)}")
-                        continue
+                process_new_videos(new_videos)
                 
                 if not new_videos:
                     print("✅ Nessun nuovo video trovato")
+
+        # Mantiene limitata la dimensione della cache delle trascrizioni e delle consegne
+        apply_retention()
+        clean_up_deliveries()
             
     except Exception as e:
         print(f"❌ Errore critico nell'esecuzione del programma: {str(e)}")
+    finally:
+        # Completa l'invio dei messaggi accodati e rilascia le connessioni del pool
+        outbox.stop()
+        flush_access_stats()
+        close_pool()
+        write_textfile()
+        print(f"⏱️ Esecuzione completata in {time.perf_counter() - _process_start:.1f} s")
+
+def enqueue_videos(videos, submit):
+    """Accoda i video nella pipeline invece di processarli direttamente"""
+    for video in videos:
+        try:
+            submit(video)
+        except Exception as e:
+            print(f"❌ Errore nell'accodamento del video {video['video_id']}: {str(e)}")
+    return bool(videos)
+
+def main_daemon(use_pipeline=False):
+    """Esegue l'inizializzazione una sola volta e poi polling e riprocessamento a intervalli.
+
+    Con use_pipeline i video vengono accodati nella coda persistente e processati dai worker
+    dei singoli stadi, così le notifiche non attendono il riassunto degli altri video.
+    """
+    pipeline = None
+    try:
+        if not setup():
+            return
+
+        poll_plan = ChannelPollPlan()
+        if use_pipeline:
+            pipeline = Pipeline()
+            pipeline.start()
+
+        def poll_and_process():
+            new_videos = poll_due_channels(poll_plan)
+            if use_pipeline:
+                enqueue_videos(new_videos, submit_new_video)
+            else:
+                process_new_videos(new_videos)
+
+        scheduler = Scheduler()
+        scheduler.every("polling", DAEMON_POLL_TICK, poll_and_process)
+        if use_pipeline:
+            scheduler.every("video non processati", DAEMON_SUMMARY_INTERVAL,
+                            lambda: enqueue_videos(get_unprocessed_videos(), submit_video_for_processing))
+            scheduler.every("riprocessamento", DAEMON_REPROCESS_INTERVAL,
+                            lambda: enqueue_videos(get_videos_to_reprocess(), submit_video_for_processing))
+            scheduler.every("pulizia coda", 24 * 3600, purge_finished_jobs)
+            scheduler.every("trascrizioni in attesa", DAEMON_POLL_TICK,
+                            lambda: enqueue_videos(check_pending_transcripts(), submit_video_for_processing))
+        else:
+            scheduler.every("trascrizioni in attesa", DAEMON_POLL_TICK, process_ready_transcripts)
+            scheduler.every("video non processati", DAEMON_SUMMARY_INTERVAL, process_unprocessed_videos)
+            scheduler.every("riprocessamento", DAEMON_REPROCESS_INTERVAL, process_pending_videos)
+        scheduler.every("statistiche cache", 60, flush_access_stats)
+        scheduler.every("conservazione cache", RETENTION_INTERVAL, apply_retention)
+        # Eseguita anche all'avvio: riprende le consegne interrotte dall'arresto precedente
+        scheduler.every("pulizia consegne", 24 * 3600, clean_up_deliveries)
+        if METRICS_FILE:
+            scheduler.every("metriche", METRICS_WRITE_INTERVAL, write_textfile)
+        scheduler.install_signal_handlers()
+
+        print("🚀 Avvio in modalità daemon")
+        scheduler.run()
+        print("👋 Daemon arrestato")
+
+    except Exception as e:
+        print(f"❌ Errore critico nell'esecuzione del programma: {str(e)}")
+    finally:
+        if pipeline:
+            pipeline.stop()
+        outbox.stop()
+        flush_access_stats()
+        close_pool()
+        write_textfile()
+
+def main_manage_channel(channel_id, name=None, languages=None, enabled=True):
+    """Aggiunge, riattiva o disabilita un canale nel registro (effetto dal prossimo ciclo di polling)"""
+    try:
+        init_db()
+        if enabled:
+            add_channel(channel_id, name, languages)
+            print(f"✅ Canale {name} ({channel_id}) registrato")
+        elif set_channel_enabled(channel_id, False):
+            print(f"✅ Canale {channel_id} disabilitato")
+        else:
+            print(f"⚠️ Canale {channel_id} non presente nel registro")
+    except Exception as e:
+        print(f"❌ Errore nella gestione del canale {channel_id}: {str(e)}")
+    finally:
+        close_pool()
+
+def main_subscribe(chat_id, channel_id):
+    """Iscrive una chat a un canale senza avviare il monitoraggio"""
+    try:
+        init_db()
+        subscribe(chat_id, channel_id)
+    except Exception as e:
+        print(f"❌ Errore nell'iscrizione della chat {chat_id}: {str(e)}")
+    finally:
+        outbox.stop()
+        close_pool()
+
+def main_invalidate_summaries(model_name=None, strategy=None, prompt_hash=None):
+    """Invalida i riassunti in cache che corrispondono ai filtri indicati"""
+    try:
+        init_db()
+        invalidated = invalidate_summaries(prompt_hash=prompt_hash, model_name=model_name, strategy=strategy)
+        print(f"✅ {invalidated} riassunti in cache invalidati")
+    except ValueError as e:
+        print(f"❌ {str(e)}")
+    except Exception as e:
+        print(f"❌ Errore nell'invalidazione dei riassunti: {str(e)}")
+    finally:
+        close_pool()
+
+def main_search(query, page=1):
+    """Stampa una pagina di risultati della ricerca su trascrizioni e riassunti"""
+    try:
+        init_db()
+        results, has_more = search_videos(query, page)
+        print(format_search_results(query, results, page, has_more))
+    except SearchError as e:
+        print(f"❌ {str(e)}")
+    finally:
+        close_pool()
 
 if __name__ == "__main__":
-    main_single_run() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Monitora i canali YouTube e invia i riassunti su Telegram")
+    parser.add_argument("--daemon", action="store_true",
+                        help="resta in esecuzione e ripete i controlli a intervalli regolari")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="in modalità daemon, processa i video tramite la coda persistente a stadi")
+    parser.add_argument("--subscribe", nargs=2, metavar=("CHAT_ID", "CHANNEL_ID"),
+                        help="iscrive una chat a un canale e le invia l'ultimo riassunto disponibile")
+    parser.add_argument("--add-channel", nargs=2, metavar=("CHANNEL_ID", "NAME"),
+                        help="aggiunge (o riattiva) un canale nel registro")
+    parser.add_argument("--languages",
+                        help="con --add-channel, lingue preferite delle trascrizioni separate da virgola")
+    parser.add_argument("--disable-channel", metavar="CHANNEL_ID",
+                        help="sospende il polling di un canale")
+    parser.add_argument("--invalidate-summaries", action="store_true",
+                        help="invalida i riassunti in cache filtrati con --model, --strategy o --prompt-hash")
+    parser.add_argument("--model", help="con --invalidate-summaries, modello che ha prodotto i riassunti")
+    parser.add_argument("--strategy", choices=("single", "chunked", "batch"),
+                        help="con --invalidate-summaries, strategia con cui sono stati generati")
+    parser.add_argument("--prompt-hash", help="con --invalidate-summaries, hash dei prompt usati")
+    parser.add_argument("--search", metavar="QUERY",
+                        help="cerca i video che citano i termini nei riassunti o nelle trascrizioni")
+    parser.add_argument("--page", type=int, default=1,
+                        help="con --search, pagina dei risultati da mostrare")
+    args = parser.parse_args()
+
+    if args.add_channel:
+        languages = [lang.strip() for lang in (args.languages or "").split(",") if lang.strip()]
+        main_manage_channel(*args.add_channel, languages=languages)
+    elif args.disable_channel:
+        main_manage_channel(args.disable_channel, enabled=False)
+    elif args.subscribe:
+        main_subscribe(*args.subscribe)
+    elif args.invalidate_summaries:
+        main_invalidate_summaries(args.model, args.strategy, args.prompt_hash)
+    elif args.search:
+        main_search(args.search, args.page)
+    elif args.daemon:
+        main_daemon(use_pipeline=args.pipeline)
+    else:
+        main_single_run()
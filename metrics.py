@@ -0,0 +1,233 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_ENABLED, METRICS_FILE, METRICS_PORT, LOG_LEVEL, LOG_FORMAT
+
+# Limiti (in secondi) dei bucket degli istogrammi di latenza
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+logger = logging.getLogger("yt_transcript")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    logger.propagate = False
+
+# Calcolato una volta sola: con LOG_LEVEL sopra DEBUG le osservazioni non vengono registrate
+_log_observations = logger.isEnabledFor(logging.DEBUG)
+
+def log_event(event, level=logging.INFO, **fields):
+    """Registra un evento strutturato (JSON o chiave=valore secondo LOG_FORMAT)"""
+    if not logger.isEnabledFor(level):
+        return
+    if LOG_FORMAT == "json":
+        message = json.dumps({"event": event, **fields}, default=str, ensure_ascii=False)
+    else:
+        message = " ".join([f"event={event}"] + [f"{key}={value}" for key, value in fields.items()])
+    logger.log(level, message)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    """Contatore monotono con etichette opzionali"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        if _log_observations:
+            log_event(self.name, logging.DEBUG, value=amount, **labels)
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+class Histogram:
+    """Istogramma di latenze con bucket cumulativi, somma e conteggio per etichetta"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # etichette -> [conteggi per bucket, somma, conteggio]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+        if _log_observations:
+            log_event(self.name, logging.DEBUG, seconds=round(value, 6), **labels)
+
+    @contextmanager
+    def time(self, **labels):
+        """Misura la durata del blocco, anche se termina con un'eccezione"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        """Restituisce (conteggi per bucket, somma, conteggio) per le etichette indicate"""
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            counts, total, count = self.values.get(key, [[0] * len(self.buckets), 0.0, 0])
+            return list(counts), total, count
+
+    def totals(self):
+        """Restituisce (somma, conteggio) su tutte le etichette"""
+        with self.lock:
+            return (sum(entry[1] for entry in self.values.values()),
+                    sum(entry[2] for entry in self.values.values()))
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self.values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class Registry:
+    """Insieme delle metriche esportate"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Esporta tutte le metriche nel formato testuale di Prometheus"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+def timed(metric, **labels):
+    """Decoratore che misura la durata di ogni chiamata; con le metriche disattivate non aggiunge nulla"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metric.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Metriche dei singoli componenti
+rss_fetch_seconds = histogram("yt_rss_fetch_seconds", "Durata del download di un feed RSS")
+rss_feeds_total = counter("yt_rss_feeds_total", "Feed RSS scaricati per esito", ["result"])
+transcript_fetch_seconds = histogram("yt_transcript_fetch_seconds", "Durata del download di una trascrizione")
+transcripts_total = counter("yt_transcripts_total", "Trascrizioni richieste per esito", ["result"])
+ai_rate_limit_wait_seconds = histogram("yt_ai_rate_limit_wait_seconds",
+                                       "Attesa del rate limiter prima di una chiamata a Gemini", ["model"])
+ai_generate_seconds = histogram("yt_ai_generate_seconds", "Durata di una chiamata a Gemini", ["model"])
+ai_requests_total = counter("yt_ai_requests_total", "Chiamate a Gemini per esito", ["model", "result"])
+summary_seconds = histogram("yt_summary_seconds", "Durata complessiva di get_summary")
+summary_cache_total = counter("yt_summary_cache_total", "Esiti della cache dei riassunti per contenuto", ["result"])
+telegram_send_seconds = histogram("yt_telegram_send_seconds", "Durata dell'invio di un messaggio Telegram")
+telegram_throttle_seconds = histogram("yt_telegram_throttle_seconds", "Attesa dei limiti di invio Telegram")
+telegram_errors_total = counter("yt_telegram_errors_total", "Errori di invio Telegram per tipo", ["kind"])
+db_query_seconds = histogram("yt_db_query_seconds", "Durata delle query per funzione chiamante", ["operation"])
+transcript_cache_total = counter("yt_transcript_cache_total",
+                                 "Esiti della cache delle trascrizioni in process_video_with_cache", ["result"])
+
+def write_textfile(path=METRICS_FILE):
+    """Scrive le metriche su file in modo atomico (per il textfile collector di node_exporter)"""
+    if not path or not METRICS_ENABLED:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(registry.render())
+    os.replace(tmp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Le richieste di Prometheus non finiscono nel log
+        pass
+
+def start_http_server(port=METRICS_PORT):
+    """Espone /metrics su HTTP in un thread separato (0 = disattivato)"""
+    if not port or not METRICS_ENABLED:
+        return None
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 Metriche esposte su http://0.0.0.0:{port}/metrics")
+    return server
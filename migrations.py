@@ -0,0 +1,346 @@
+import psycopg
+from db_operations import compress_text, decompress_text, tsvector_sql, SUMMARY_SEARCH_CONFIGS
+
+# Chiave del lock advisory che serializza l'applicazione delle migrazioni tra processi
+MIGRATION_LOCK_KEY = 727270001
+
+def _compress_legacy_transcripts(cur, batch_size=500):
+    """Comprime le trascrizioni salvate in chiaro prima dell'introduzione della compressione"""
+    while True:
+        cur.execute('''
+            SELECT video_id, transcript FROM transcript_cache
+            WHERE transcript IS NOT NULL
+            LIMIT %s
+        ''', (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        cur.executemany('''
+            UPDATE transcript_cache
+            SET transcript_compressed = %s, transcript = NULL
+            WHERE video_id = %s
+        ''', [(compress_text(transcript), video_id) for video_id, transcript in rows])
+        print(f"🗜️ Compresse {len(rows)} trascrizioni salvate in chiaro")
+
+def _index_cached_transcripts(cur, batch_size=200):
+    """Calcola il vettore di ricerca delle trascrizioni già presenti in cache"""
+    while True:
+        cur.execute('''
+            SELECT video_id, transcript_compressed FROM transcript_cache
+            WHERE transcript_compressed IS NOT NULL AND transcript_tsv IS NULL
+            LIMIT %s
+        ''', (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        cur.execute(f'''
+            UPDATE transcript_cache tc
+            SET transcript_tsv = {tsvector_sql('t.transcript_text')}
+            FROM unnest(%s::text[], %s::text[]) AS t(video_id, transcript_text)
+            WHERE tc.video_id = t.video_id
+        ''', ([video_id for video_id, _ in rows], [decompress_text(data) for _, data in rows]))
+        print(f"🔎 Indicizzate {len(rows)} trascrizioni per la ricerca")
+
+# Migrazioni in ordine: (versione, descrizione, passi). Ogni passo è una query SQL
+# oppure una funzione che riceve il cursore. Le migrazioni già pubblicate non vanno
+# modificate: ogni cambiamento dello schema richiede una nuova versione.
+MIGRATIONS = [
+    (1, "tabelle video_state e transcript_cache", [
+        '''
+        CREATE TABLE IF NOT EXISTS video_state (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT NOT NULL,
+            last_video_id TEXT NOT NULL
+        )
+        ''',
+        # Database creati prima dell'introduzione di channel_name
+        'ALTER TABLE video_state ADD COLUMN IF NOT EXISTS channel_name TEXT',
+        "UPDATE video_state SET channel_name = 'Unknown' WHERE channel_name IS NULL",
+        'ALTER TABLE video_state ALTER COLUMN channel_name SET NOT NULL',
+        '''
+        CREATE TABLE IF NOT EXISTS transcript_cache (
+            video_id TEXT PRIMARY KEY,
+            transcript TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            access_count INTEGER DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_cache_created ON transcript_cache (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_cache_access ON transcript_cache (access_count)',
+    ]),
+    (2, "stato HTTP dei feed RSS", [
+        '''
+        CREATE TABLE IF NOT EXISTS feed_state (
+            channel_id TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        ''',
+    ]),
+    (3, "indice dei video già visti", [
+        '''
+        CREATE TABLE IF NOT EXISTS seen_videos (
+            channel_id TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            emitted BOOLEAN NOT NULL DEFAULT TRUE,
+            first_seen_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (channel_id, video_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_seen_emitted ON seen_videos (video_id) WHERE emitted',
+        # Considera già visto l'ultimo video registrato in video_state
+        '''
+        INSERT INTO seen_videos (channel_id, video_id)
+        SELECT channel_id, last_video_id FROM video_state
+        ON CONFLICT DO NOTHING
+        ''',
+    ]),
+    (4, "coda persistente dei job della pipeline", [
+        '''
+        CREATE TABLE IF NOT EXISTS job_queue (
+            id BIGSERIAL PRIMARY KEY,
+            stage TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE (stage, video_id)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_job_queue_ready
+        ON job_queue (stage, available_at) WHERE status = 'pending'
+        ''',
+    ]),
+    (5, "stato esplicito dei riassunti e cache per contenuto", [
+        '''
+        ALTER TABLE transcript_cache
+        ADD COLUMN IF NOT EXISTS summary_status TEXT NOT NULL DEFAULT 'ok',
+        ADD COLUMN IF NOT EXISTS summary_key TEXT
+        ''',
+        '''
+        UPDATE transcript_cache SET summary_status = 'error'
+        WHERE summary_status = 'ok' AND summary LIKE '⚠️ Riassunto non disponibile%'
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_cache_summary_error
+        ON transcript_cache (updated_at) WHERE summary_status = 'error'
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            cache_key TEXT PRIMARY KEY,
+            transcript_hash TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'ok',
+            created_at TIMESTAMP DEFAULT NOW(),
+            hit_count INTEGER DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_summary_prompt_model ON summary_cache (prompt_hash, model_name)',
+    ]),
+    (6, "trascrizioni compresse", [
+        '''
+        ALTER TABLE transcript_cache
+        ADD COLUMN IF NOT EXISTS transcript_compressed BYTEA,
+        ALTER COLUMN transcript DROP NOT NULL
+        ''',
+        _compress_legacy_transcripts,
+    ]),
+    (7, "cache negativa dei video falliti", [
+        '''
+        CREATE TABLE IF NOT EXISTS video_failures (
+            video_id TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            next_attempt_at TIMESTAMP NOT NULL,
+            gave_up BOOLEAN NOT NULL DEFAULT FALSE,
+            first_failed_at TIMESTAMP DEFAULT NOW(),
+            last_failed_at TIMESTAMP DEFAULT NOW()
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_failures_next_attempt ON video_failures (next_attempt_at) WHERE NOT gave_up',
+    ]),
+    (8, "iscrizioni delle chat e tracciamento delle consegne", [
+        '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (chat_id, channel_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_subscriptions_channel ON subscriptions (channel_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS deliveries (
+            video_id TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT NOW(),
+            sent_at TIMESTAMP,
+            PRIMARY KEY (video_id, chat_id, kind)
+        )
+        ''',
+    ]),
+    (9, "registro dei canali con pianificazione del polling", [
+        '''
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            priority INTEGER NOT NULL DEFAULT 0,
+            languages TEXT[],
+            poll_interval REAL,
+            error_streak INTEGER NOT NULL DEFAULT 0,
+            last_polled_at TIMESTAMP,
+            next_poll_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_channels_due
+        ON channels (priority DESC, next_poll_at) WHERE enabled
+        ''',
+        # I canali già monitorati restano registrati anche se rimossi dalla configurazione
+        '''
+        INSERT INTO channels (channel_id, name)
+        SELECT channel_id, channel_name FROM video_state
+        ON CONFLICT DO NOTHING
+        ''',
+    ]),
+    (10, "metadati dei video dai feed RSS", [
+        '''
+        CREATE TABLE IF NOT EXISTS videos (
+            video_id TEXT PRIMARY KEY,
+            channel_id TEXT NOT NULL,
+            title TEXT,
+            link TEXT,
+            published_at TIMESTAMPTZ,
+            first_seen_at TIMESTAMP DEFAULT NOW()
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_videos_channel ON videos (channel_id, first_seen_at)',
+        # I video visti in precedenza restano senza titolo: verrà usato quello generico
+        '''
+        INSERT INTO videos (video_id, channel_id, first_seen_at)
+        SELECT DISTINCT ON (video_id) video_id, channel_id, first_seen_at
+        FROM seen_videos
+        ORDER BY video_id, first_seen_at
+        ON CONFLICT DO NOTHING
+        ''',
+    ]),
+    (11, "trascrizioni in attesa di dirette e première", [
+        '''
+        CREATE TABLE IF NOT EXISTS pending_transcripts (
+            video_id TEXT PRIMARY KEY,
+            transcript TEXT NOT NULL DEFAULT '',
+            segment_count INTEGER NOT NULL DEFAULT 0,
+            last_segment_start REAL NOT NULL DEFAULT -1,
+            stable_polls INTEGER NOT NULL DEFAULT 0,
+            polls INTEGER NOT NULL DEFAULT 0,
+            next_check_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_pending_transcripts_due ON pending_transcripts (next_check_at)',
+    ]),
+    (12, "conservazione della cache delle trascrizioni", [
+        'ALTER TABLE transcript_cache ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP',
+        # Indici per la scelta delle voci da rimuovere (LRU e LFU) tra quelle con trascrizione
+        '''
+        CREATE INDEX IF NOT EXISTS idx_cache_lru
+        ON transcript_cache (updated_at) WHERE archived_at IS NULL
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_cache_lfu
+        ON transcript_cache (access_count, updated_at) WHERE archived_at IS NULL
+        ''',
+    ]),
+    (13, "ricerca testuale su trascrizioni e riassunti", [
+        # I riassunti falliti contengono il messaggio di errore e restano fuori dalla ricerca
+        f'''
+        ALTER TABLE transcript_cache ADD COLUMN IF NOT EXISTS summary_tsv tsvector
+        GENERATED ALWAYS AS ({tsvector_sql("CASE WHEN summary_status = 'ok' THEN summary END",
+                                           SUMMARY_SEARCH_CONFIGS, 'A')}) STORED
+        ''',
+        # Le trascrizioni sono compresse: il vettore viene calcolato dall'applicazione in scrittura
+        'ALTER TABLE transcript_cache ADD COLUMN IF NOT EXISTS transcript_tsv tsvector',
+        'CREATE INDEX IF NOT EXISTS idx_cache_summary_tsv ON transcript_cache USING GIN (summary_tsv)',
+        'CREATE INDEX IF NOT EXISTS idx_cache_transcript_tsv ON transcript_cache USING GIN (transcript_tsv)',
+        _index_cached_transcripts,
+    ]),
+    (14, "modello e strategia effettivi dei riassunti in cache", [
+        # Le voci precedenti sono state tutte registrate come prodotte da AI_MODEL con richiesta singola
+        "ALTER TABLE summary_cache ADD COLUMN IF NOT EXISTS strategy TEXT NOT NULL DEFAULT 'single'",
+    ]),
+    # I video visti sono in seen_videos dalla migrazione 3: video_state conserva solo il nome del canale
+    (15, "rimozione dell'ultimo video per canale", [
+        'ALTER TABLE video_state DROP COLUMN IF EXISTS last_video_id',
+    ]),
+    (16, "pulizia delle consegne", [
+        'CREATE INDEX IF NOT EXISTS idx_deliveries_created ON deliveries (created_at)',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Legge la versione dello schema con un'unica query (0 se mai migrato)"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            return cur.fetchone()[0]
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return 0
+
+def apply_migrations(conn):
+    """Applica in ordine le migrazioni mancanti, ognuna nella propria transazione"""
+    current = get_schema_version(conn)
+    conn.commit()
+    if current >= LATEST_VERSION:
+        return 0
+
+    applied = 0
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        ''')
+        conn.commit()
+
+        for version, description, steps in MIGRATIONS:
+            # Il lock evita che due processi avviati insieme applichino la stessa migrazione
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cur.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+            if cur.fetchone():
+                conn.commit()
+                continue
+
+            print(f"🛠️ Applico la migrazione {version}: {description}...")
+            for step in steps:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (version, description))
+            conn.commit()
+            applied += 1
+    return applied
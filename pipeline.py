@@ -0,0 +1,175 @@
+import threading
+from config import (PIPELINE_TRANSCRIPT_WORKERS, PIPELINE_SUMMARY_WORKERS, PIPELINE_NOTIFY_WORKERS,
+                    PIPELINE_VISIBILITY_TIMEOUT, PIPELINE_IDLE_WAIT)
+from db_operations import get_cached_transcript, cache_transcript, record_video_failure
+from job_queue import enqueue_job, claim_job, complete_job, fail_job
+from youtube_handler import get_transcript
+from telegram_handler import format_video_message, format_missing_summary_message
+from fanout import fan_out, wait_for_deliveries, KIND_ANNOUNCE, KIND_SUMMARY, KIND_MISSING
+from live_transcripts import handle_missing_transcript, MISSING_PENDING, MISSING_NOTIFY
+from ai_handler import get_summary, summary_cache_key
+
+# Stadi della pipeline, nell'ordine in cui un video li attraversa
+STAGE_ANNOUNCE = "announce"
+STAGE_TRANSCRIPT = "transcript"
+STAGE_SUMMARY = "summarise"
+STAGE_NOTIFY = "notify"
+
+class PipelineError(Exception):
+    """Classe base per le eccezioni della pipeline"""
+    pass
+
+def deliver(video_info, messages):
+    """Consegna i messaggi a tutte le chat iscritte e attende l'esito.
+
+    Se un invio fallisce il job viene ritentato: le consegne già riuscite non vengono ripetute.
+    """
+    wait_for_deliveries(fan_out(video_info, messages))
+
+def handle_announce(job):
+    """Invia subito la notifica del nuovo video, senza attendere trascrizione e riassunto"""
+    deliver(job.payload["video"], [(KIND_ANNOUNCE, format_video_message(job.payload["video"]))])
+    return STAGE_TRANSCRIPT, job.payload
+
+def handle_transcript(job):
+    """Recupera la trascrizione (dalla cache se presente) e passa il video al riassunto"""
+    video_info = job.payload["video"]
+    cached_transcript, cached_summary = get_cached_transcript(job.video_id)
+
+    if cached_summary:
+        print(f"✅ Usando dati dalla cache per {video_info.get('title', job.video_id)}")
+        return STAGE_NOTIFY, {**job.payload, "summary": cached_summary}
+
+    transcript = video_info.get("transcript") or cached_transcript
+    if not transcript:
+        try:
+            transcript = get_transcript(job.video_id, video_info.get("languages"))[0]
+        except Exception:
+            # Come nel ciclo singolo: il video non torna tra i non processati prima dell'attesa
+            record_video_failure(job.video_id, "transcript_error")
+            raise
+    if not transcript:
+        outcome = handle_missing_transcript(video_info)
+        if outcome == MISSING_PENDING:
+            # Diretta o première: il video torna in coda quando la trascrizione è completa
+            if job.payload.get("announce"):
+                deliver(video_info, [(KIND_ANNOUNCE, format_video_message(video_info))])
+            return None, None
+        if outcome == MISSING_NOTIFY:
+            # Notifica l'assenza del riassunto solo al primo tentativo
+            messages = [(KIND_MISSING, format_missing_summary_message(video_info))]
+            if job.payload.get("announce"):
+                messages.insert(0, (KIND_ANNOUNCE, format_video_message(video_info)))
+            deliver(video_info, messages)
+        print(f"⏩ Saltato il riassunto per {video_info['title']} (trascrizione non disponibile)")
+        return None, None
+
+    return STAGE_SUMMARY, {**job.payload, "transcript": transcript}
+
+def handle_summary(job):
+    """Genera il riassunto e lo salva in cache insieme alla trascrizione"""
+    video_info = job.payload["video"]
+    transcript = job.payload["transcript"]
+    summary = get_summary(transcript, video_info.get("title", "Video senza titolo"), job.video_id)
+    cache_transcript(job.video_id, transcript, summary, summary_key=summary_cache_key(transcript)[0])
+    return STAGE_NOTIFY, {"video": video_info, "summary": summary,
+                          "announce": job.payload.get("announce", False)}
+
+def give_up_summary(job, error):
+    """Dopo l'ultimo tentativo salva la trascrizione con il riassunto di errore, per il riprocessamento"""
+    error_summary = f"⚠️ Riassunto non disponibile a causa di un errore: {str(error)}"
+    cache_transcript(job.video_id, job.payload["transcript"], error_summary, summary_status='error')
+    if job.payload.get("announce"):
+        deliver(job.payload["video"], [(KIND_ANNOUNCE, format_video_message(job.payload["video"]))])
+
+def handle_notify(job):
+    """Invia il riassunto (preceduto dalla notifica del video per i video riprocessati)"""
+    video_info = job.payload["video"]
+    messages = [(KIND_SUMMARY, job.payload["summary"])]
+    if job.payload.get("announce"):
+        messages.insert(0, (KIND_ANNOUNCE, format_video_message(video_info)))
+    deliver(video_info, messages)
+    return None, None
+
+# Gestori, funzione di abbandono e numero di worker per stadio
+STAGES = {
+    STAGE_ANNOUNCE: (handle_announce, None, PIPELINE_NOTIFY_WORKERS),
+    STAGE_TRANSCRIPT: (handle_transcript, None, PIPELINE_TRANSCRIPT_WORKERS),
+    STAGE_SUMMARY: (handle_summary, give_up_summary, PIPELINE_SUMMARY_WORKERS),
+    STAGE_NOTIFY: (handle_notify, None, PIPELINE_NOTIFY_WORKERS),
+}
+
+def retry_delay(attempts):
+    """Attesa esponenziale tra i tentativi di un job (da 30 secondi a 30 minuti)"""
+    return min(30 * 2 ** max(attempts - 1, 0), 1800)
+
+class StageWorker(threading.Thread):
+    """Worker che preleva ed esegue i job di un singolo stadio"""
+
+    def __init__(self, stage, stop_event, visibility_timeout=PIPELINE_VISIBILITY_TIMEOUT,
+                 idle_wait=PIPELINE_IDLE_WAIT):
+        super().__init__(name=f"pipeline-{stage}", daemon=True)
+        self.stage = stage
+        self.handler, self.on_give_up, _ = STAGES[stage]
+        self.stop_event = stop_event
+        self.visibility_timeout = visibility_timeout
+        self.idle_wait = idle_wait
+
+    def run(self):
+        while not self.stop_event.is_set():
+            job = claim_job(self.stage, self.visibility_timeout)
+            if job is None:
+                self.stop_event.wait(self.idle_wait)
+                continue
+            self.process(job)
+
+    def process(self, job):
+        try:
+            next_stage, next_payload = self.handler(job)
+        except Exception as e:
+            print(f"❌ Errore nello stadio {self.stage} per il video {job.video_id} "
+                  f"(tentativo {job.attempts}/{job.max_attempts}): {str(e)}")
+            if job.is_last_attempt and self.on_give_up:
+                try:
+                    self.on_give_up(job, e)
+                except Exception as give_up_error:
+                    print(f"❌ Errore nella gestione del fallimento per {job.video_id}: {str(give_up_error)}")
+            fail_job(job, e, retry_delay(job.attempts))
+            return
+
+        try:
+            complete_job(job, next_stage, next_payload)
+        except Exception:
+            # Il job tornerà visibile allo scadere del timeout e verrà ripreso
+            pass
+
+class Pipeline:
+    """Insieme dei worker di tutti gli stadi, avviati e arrestati insieme"""
+
+    def __init__(self, stages=STAGES):
+        self.stop_event = threading.Event()
+        self.workers = [
+            StageWorker(stage, self.stop_event)
+            for stage, (_, _, worker_count) in stages.items()
+            for _ in range(max(1, worker_count))
+        ]
+
+    def start(self):
+        print(f"🚀 Avvio pipeline con {len(self.workers)} worker")
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout=None):
+        """Arresta i worker dopo il job in corso; i job non completati restano in coda"""
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout)
+
+def submit_new_video(video_info):
+    """Accoda un nuovo video: la notifica parte subito, il riassunto segue negli stadi successivi"""
+    enqueue_job(STAGE_ANNOUNCE, video_info["video_id"], {"video": video_info})
+
+def submit_video_for_processing(video_info):
+    """Accoda un video già notificato in passato (non processato o da riprocessare)"""
+    # La notifica del video viene ripetuta insieme al riassunto, come in process_new_video
+    enqueue_job(STAGE_TRANSCRIPT, video_info["video_id"], {"video": video_info, "announce": True})
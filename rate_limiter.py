@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """Token bucket con ricarica continua: `rate` token al minuto, fino a `capacity`"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Secondi da attendere perché siano disponibili `amount` token (senza consumarli)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        missing = amount - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+    def consume(self, amount, now):
+        """Prenota `amount` token; il saldo può diventare negativo (attesa già calcolata)"""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+class RateLimiter:
+    """Rate limiter per coppia (chiave API, modello) con budget di richieste e token al minuto.
+
+    Per ogni chiamata sceglie la chiave API che può essere usata prima, prenota richiesta e
+    token sotto lock e poi attende fuori dal lock: è sicuro da usare da più thread e da asyncio.
+    """
+
+    def __init__(self, api_keys, budgets):
+        # budgets: nome modello -> (richieste al minuto, token al minuto, burst di richieste)
+        self.api_keys = list(api_keys)
+        self.budgets = budgets
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _buckets_for(self, key_index, model_name):
+        buckets = self.buckets.get((key_index, model_name))
+        if buckets is None:
+            rpm, tpm, burst = self.budgets[model_name]
+            buckets = self.buckets[(key_index, model_name)] = (
+                TokenBucket(rpm, burst) if rpm else None,
+                TokenBucket(tpm) if tpm else None
+            )
+        return buckets
+
+    def reserve(self, model_name, tokens):
+        """Prenota una chiamata e restituisce (indice della chiave API, secondi da attendere)"""
+        with self.lock:
+            now = time.monotonic()
+            best_index, best_wait = 0, None
+            for key_index in range(len(self.api_keys)):
+                waits = [
+                    bucket.wait_time(amount, now)
+                    for bucket, amount in zip(self._buckets_for(key_index, model_name), (1, tokens))
+                    if bucket is not None
+                ]
+                wait = max(waits, default=0.0)
+                if best_wait is None or wait < best_wait:
+                    best_index, best_wait = key_index, wait
+
+            for bucket, amount in zip(self._buckets_for(best_index, model_name), (1, tokens)):
+                if bucket is not None:
+                    bucket.consume(amount, now)
+            return best_index, best_wait or 0.0
+
+    def acquire(self, model_name, tokens=0):
+        """Attende il proprio turno e restituisce l'indice della chiave API da usare"""
+        key_index, wait = self.reserve(model_name, tokens)
+        if wait > 0:
+            print(f"⏳ Attendo {wait:.1f} secondi per rispettare il rate limit di {model_name}...")
+            time.sleep(wait)
+        return key_index
+
+    async def acquire_async(self, model_name, tokens=0):
+        """Versione asincrona di acquire"""
+        key_index, wait = self.reserve(model_name, tokens)
+        if wait > 0:
+            print(f"⏳ Attendo {wait:.1f} secondi per rispettare il rate limit di {model_name}...")
+            await asyncio.sleep(wait)
+        return key_index
+
+def estimate_tokens(text):
+    """Stima approssimativa dei token di un testo (circa 4 caratteri per token)"""
+    return len(text) // 4 + 1
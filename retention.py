@@ -0,0 +1,153 @@
+import psycopg
+from config import (RETENTION_MODE, RETENTION_TTL_DAYS, RETENTION_MAX_ROWS, RETENTION_POLICY,
+                    RETENTION_BATCH_SIZE, RETENTION_MAX_BATCHES, RETENTION_LOCK_TIMEOUT, DELIVERY_RETENTION_DAYS)
+from db_operations import get_connection, DatabaseError
+
+# Ordine di rimozione per il limite di dimensione (serviti dagli indici parziali idx_cache_lru/lfu)
+POLICY_ORDER = {
+    "lru": "updated_at",
+    "lfu": "access_count, updated_at",
+}
+
+class RetentionError(Exception):
+    """Classe base per le eccezioni della conservazione della cache"""
+    pass
+
+def _candidates_filter(mode):
+    """Voci con trascrizione (coperte dagli indici parziali); in archiviazione solo con riassunto valido"""
+    if mode == "archive":
+        # Le voci con riassunto in errore tengono la trascrizione per il riprocessamento
+        return "archived_at IS NULL AND summary_status = 'ok'"
+    return "archived_at IS NULL"
+
+def _evict_batch(mode, where, order, params, limit):
+    """Archivia o elimina un lotto di voci in una transazione breve; restituisce le voci trattate.
+
+    Le righe bloccate da altre transazioni vengono saltate (SKIP LOCKED) e lock_timeout evita
+    di accodarsi dietro le scritture del percorso principale.
+    """
+    victims = f'''
+        WITH victims AS (
+            SELECT video_id FROM transcript_cache
+            WHERE {where}
+            ORDER BY {order}
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    '''
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT set_config('lock_timeout', %s, true)", (RETENTION_LOCK_TIMEOUT,))
+            if mode == "archive":
+                cur.execute(victims + '''
+                    UPDATE transcript_cache tc
+                    SET transcript = NULL, transcript_compressed = NULL, transcript_tsv = NULL, archived_at = NOW()
+                    FROM victims
+                    WHERE tc.video_id = victims.video_id
+                    RETURNING tc.video_id
+                ''', (*params, limit))
+                video_ids = [row[0] for row in cur.fetchall()]
+            else:
+                cur.execute(victims + '''
+                    DELETE FROM transcript_cache tc
+                    USING victims
+                    WHERE tc.video_id = victims.video_id
+                    RETURNING tc.video_id
+                ''', (*params, limit))
+                video_ids = [row[0] for row in cur.fetchall()]
+                if video_ids:
+                    # Un video rimosso non deve tornare tra quelli da processare
+                    cur.execute("UPDATE seen_videos SET emitted = FALSE WHERE video_id = ANY(%s)", (video_ids,))
+        conn.commit()
+    return len(video_ids)
+
+def _count_candidates(mode, limit):
+    """Conta le voci candidate secondo _candidates_filter, fermandosi a `limit` voci.
+
+    Il conteggio limitato è esatto fino alla soglia, anche su statistiche non aggiornate,
+    e non scorre mai l'intera tabella.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM transcript_cache WHERE {_candidates_filter(mode)} LIMIT %s
+                ) candidates
+            ''', (limit,))
+            return cur.fetchone()[0]
+
+def _run_batches(mode, where, order, params, total=None, max_batches=RETENTION_MAX_BATCHES):
+    """Ripete i lotti finché ci sono voci da trattare, fino a `total` voci e `max_batches` lotti"""
+    evicted = 0
+    for _ in range(max_batches):
+        limit = RETENTION_BATCH_SIZE if total is None else min(RETENTION_BATCH_SIZE, total - evicted)
+        if limit <= 0:
+            break
+        try:
+            count = _evict_batch(mode, where, order, params, limit)
+        except psycopg.errors.LockNotAvailable:
+            print("⏳ Conservazione della cache sospesa: tabella occupata, riprovo al prossimo ciclo")
+            break
+        evicted += count
+        if count < limit:
+            break
+    return evicted
+
+def apply_retention(mode=RETENTION_MODE, ttl_days=RETENTION_TTL_DAYS, max_rows=RETENTION_MAX_ROWS,
+                    policy=RETENTION_POLICY):
+    """Applica le regole di conservazione della cache delle trascrizioni.
+
+    Prima rimuove le voci più vecchie di `ttl_days`, poi, se le voci con trascrizione superano
+    `max_rows`, quelle usate meno di recente (lru) o meno spesso (lfu). In modalità 'archive'
+    viene eliminato solo il testo della trascrizione (insieme al suo indice di ricerca, che
+    altrimenti occuperebbe quasi lo stesso spazio) e il riassunto resta disponibile: un video
+    archiviato si trova ancora dal riassunto ma non più dalla trascrizione. In modalità 'drop'
+    la voce viene eliminata. Restituisce il numero di voci trattate.
+    """
+    if mode not in ("archive", "drop"):
+        raise RetentionError(f"Modalità di conservazione non valida: {mode}")
+    if policy not in POLICY_ORDER:
+        raise RetentionError(f"Politica di conservazione non valida: {policy}")
+
+    try:
+        evicted = 0
+        if ttl_days > 0:
+            # In eliminazione scadono anche le voci già archiviate (servite da idx_cache_created)
+            expired = "created_at < NOW() - make_interval(days => %s)"
+            if mode == "archive":
+                expired = f"{_candidates_filter(mode)} AND {expired}"
+            evicted += _run_batches(mode, expired, "created_at", (ttl_days,))
+        if max_rows > 0:
+            # Più di così non verrebbe comunque trattato in una sola esecuzione
+            limit = max_rows + RETENTION_BATCH_SIZE * RETENTION_MAX_BATCHES
+            excess = _count_candidates(mode, limit) - max_rows
+            if excess > 0:
+                evicted += _run_batches(mode, _candidates_filter(mode), POLICY_ORDER[policy], (),
+                                        total=excess)
+        if evicted:
+            action = "archiviate" if mode == "archive" else "eliminate"
+            print(f"🧹 Cache delle trascrizioni: {evicted} voci {action}")
+        return evicted
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella conservazione della cache: {str(e)}")
+        return 0
+
+def purge_deliveries(retention_days=DELIVERY_RETENTION_DAYS):
+    """Elimina il tracciamento delle consegne Telegram più vecchie della soglia di conservazione"""
+    if retention_days <= 0:
+        return 0
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    DELETE FROM deliveries
+                    WHERE created_at < NOW() - make_interval(days => %s)
+                ''', (retention_days,))
+                deleted = cur.rowcount
+            conn.commit()
+            if deleted:
+                print(f"🧹 Eliminate {deleted} consegne Telegram più vecchie di {retention_days} giorni")
+            return deleted
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella pulizia delle consegne: {str(e)}")
+        return 0
@@ -0,0 +1,115 @@
+import random
+import signal
+import threading
+import time
+from config import (SCHEDULER_JITTER, CHANNEL_MIN_INTERVAL, CHANNEL_MAX_INTERVAL,
+                    CHANNEL_BACKOFF_FACTOR, CHANNEL_POLL_BATCH, POLL_DEADLINE)
+from db_operations import claim_due_channels, record_channel_polls
+
+class PeriodicTask:
+    """Attività eseguita a intervalli regolari con una variazione casuale (jitter)"""
+
+    def __init__(self, name, interval, func, jitter=SCHEDULER_JITTER):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+        self.next_run = time.monotonic()  # La prima esecuzione avviene subito
+
+    def schedule_next(self):
+        """Pianifica la prossima esecuzione applicando il jitter all'intervallo"""
+        spread = self.interval * self.jitter
+        self.next_run = time.monotonic() + self.interval + random.uniform(-spread, spread)
+
+class Scheduler:
+    """Esegue le attività periodiche in un unico thread fino alla richiesta di arresto"""
+
+    def __init__(self):
+        self.tasks = []
+        self.stop_event = threading.Event()
+
+    def every(self, name, interval, func, jitter=SCHEDULER_JITTER):
+        """Registra un'attività da eseguire ogni `interval` secondi"""
+        self.tasks.append(PeriodicTask(name, interval, func, jitter))
+
+    def stop(self, *_):
+        """Richiede l'arresto: l'attività in corso viene completata prima di uscire"""
+        if not self.stop_event.is_set():
+            print("🛑 Arresto richiesto, completo l'attività in corso...")
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        """Arresta lo scheduler in modo ordinato su SIGINT e SIGTERM"""
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+    def run(self):
+        """Ciclo principale: esegue le attività scadute e attende la prossima scadenza"""
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            for task in sorted(self.tasks, key=lambda t: t.next_run):
+                if self.stop_event.is_set():
+                    break
+                if task.next_run > now:
+                    continue
+                try:
+                    task.func()
+                except Exception as e:
+                    print(f"❌ Errore nell'attività pianificata {task.name}: {str(e)}")
+                task.schedule_next()
+
+            if self.tasks:
+                next_run = min(task.next_run for task in self.tasks)
+                self.stop_event.wait(max(0.0, next_run - time.monotonic()))
+            else:
+                self.stop_event.wait()
+
+class ChannelPollPlan:
+    """Intervallo di polling adattivo per canale, salvato nel registro dei canali.
+
+    Un canale che pubblica viene ricontrollato dopo l'intervallo minimo; ogni polling
+    senza novità allunga l'intervallo di CHANNEL_BACKOFF_FACTOR fino all'intervallo massimo,
+    così i canali inattivi vengono interrogati sempre meno spesso. Un canale in errore
+    viene ritentato con attesa esponenziale in base agli errori consecutivi.
+    Ogni ciclo legge dal database solo i canali scaduti.
+    """
+
+    def __init__(self, min_interval=CHANNEL_MIN_INTERVAL, max_interval=CHANNEL_MAX_INTERVAL,
+                 backoff_factor=CHANNEL_BACKOFF_FACTOR, batch_size=CHANNEL_POLL_BATCH, lease=POLL_DEADLINE):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.batch_size = batch_size
+        self.lease = lease
+        self.channels = {}  # Canali dell'ultimo ciclo: channel_id -> riga del registro
+
+    def due_channels(self):
+        """Restituisce i canali (coppie nome, id) da interrogare in questo momento"""
+        rows = claim_due_channels(self.batch_size, self.lease)
+        self.channels = {row["channel_id"]: row for row in rows}
+        return [(row["name"], row["channel_id"]) for row in rows]
+
+    def languages(self, channel_id):
+        """Lingue preferite del canale per le trascrizioni (None = TRANSCRIPT_LANGUAGES)"""
+        row = self.channels.get(channel_id)
+        return row["languages"] if row else None
+
+    def record_poll(self, channel_ids, active_channel_ids, failed_channel_ids=()):
+        """Aggiorna intervallo ed errori dei canali interrogati e salva la prossima scadenza"""
+        results = []
+        for channel_id in channel_ids:
+            row = self.channels.get(channel_id, {})
+            interval = row.get("poll_interval") or self.min_interval
+            error_streak = 0
+            if channel_id in failed_channel_ids:
+                error_streak = row.get("error_streak", 0) + 1
+                delay = min(interval * 2 ** (error_streak - 1), self.max_interval)
+            else:
+                if channel_id in active_channel_ids:
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * self.backoff_factor, self.max_interval)
+                delay = interval
+            spread = delay * SCHEDULER_JITTER
+            results.append((channel_id, interval, error_streak, delay + random.uniform(-spread, spread)))
+        record_channel_polls(results)
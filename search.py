@@ -0,0 +1,110 @@
+import psycopg
+from config import SEARCH_CONFIGS, SEARCH_PAGE_SIZE
+from db_operations import get_connection, decompress_text, DatabaseError, SUMMARY_SEARCH_CONFIGS
+from metrics import histogram, timed
+
+# Opzioni di ts_headline: i termini trovati vengono evidenziati tra « »
+HEADLINE_OPTIONS = "StartSel=«, StopSel=», MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=\" … \""
+
+search_seconds = histogram("yt_search_seconds", "Durata di una ricerca testuale")
+
+class SearchError(Exception):
+    """Classe base per le eccezioni della ricerca"""
+    pass
+
+def _tsquery_sql():
+    """Unione delle query nelle configurazioni usate per trascrizioni e riassunti"""
+    configs = dict.fromkeys([*SEARCH_CONFIGS, *SUMMARY_SEARCH_CONFIGS])
+    return " || ".join(f"websearch_to_tsquery('{config}', %(query)s)" for config in configs)
+
+def _transcript_snippets(cur, query, transcripts):
+    """Estrae gli estratti dalle trascrizioni (decompresse qui: il database non può leggerle)"""
+    cur.execute(f'''
+        SELECT ts_headline('{SEARCH_CONFIGS[0]}', t.transcript, {_tsquery_sql()}, %(options)s)
+        FROM unnest(%(transcripts)s::text[]) WITH ORDINALITY AS t(transcript, position)
+        ORDER BY t.position
+    ''', {"query": query, "options": HEADLINE_OPTIONS, "transcripts": transcripts})
+    return [row[0] for row in cur.fetchall()]
+
+@timed(search_seconds)
+def search_videos(query, page=1, page_size=SEARCH_PAGE_SIZE):
+    """Cerca i video che citano i termini indicati nei riassunti o nelle trascrizioni.
+
+    La query accetta la sintassi di websearch_to_tsquery ("frase esatta", OR, -escluso).
+    Restituisce (risultati, altre_pagine): i risultati sono ordinati per rilevanza (i termini
+    nel riassunto pesano più di quelli nella trascrizione) e contengono un estratto.
+    """
+    query = query.strip()
+    if not query:
+        return [], False
+    page = max(page, 1)
+    tsquery = _tsquery_sql()
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # Le condizioni separate su summary_tsv e transcript_tsv usano i due indici GIN
+                cur.execute(f'''
+                    SELECT tc.video_id, v.title, v.link, COALESCE(vs.channel_name, ch.name, 'Unknown'),
+                           ts_rank(COALESCE(tc.summary_tsv, ''::tsvector) || COALESCE(tc.transcript_tsv, ''::tsvector),
+                                   {tsquery}) AS rank,
+                           CASE WHEN tc.summary_tsv @@ ({tsquery})
+                                THEN ts_headline('{SUMMARY_SEARCH_CONFIGS[0]}', tc.summary, {tsquery}, %(options)s) END,
+                           CASE WHEN NOT COALESCE(tc.summary_tsv @@ ({tsquery}), FALSE)
+                                THEN tc.transcript_compressed END
+                    FROM transcript_cache tc
+                    LEFT JOIN videos v ON v.video_id = tc.video_id
+                    LEFT JOIN video_state vs ON vs.channel_id = v.channel_id
+                    LEFT JOIN channels ch ON ch.channel_id = v.channel_id
+                    WHERE tc.summary_tsv @@ ({tsquery}) OR tc.transcript_tsv @@ ({tsquery})
+                    ORDER BY rank DESC, tc.updated_at DESC, tc.video_id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                ''', {"query": query, "options": HEADLINE_OPTIONS,
+                      "limit": page_size + 1, "offset": (page - 1) * page_size})
+                rows = cur.fetchall()
+                has_more = len(rows) > page_size
+                rows = rows[:page_size]
+
+                # Estratti dalle trascrizioni solo per i risultati che non compaiono nel riassunto
+                # (le trascrizioni archiviate non hanno più né testo né indice, quindi si trovano solo dal riassunto)
+                from_transcript = [row for row in rows if row[5] is None and row[6] is not None]
+                snippets = _transcript_snippets(
+                    cur, query, [decompress_text(row[6]) for row in from_transcript]
+                ) if from_transcript else []
+                transcript_snippets = {row[0]: snippet for row, snippet in zip(from_transcript, snippets)}
+    except (psycopg.Error, DatabaseError) as e:
+        print(f"❌ Errore nella ricerca di \"{query}\": {str(e)}")
+        raise SearchError(f"Ricerca non riuscita: {str(e)}")
+
+    results = []
+    for video_id, title, link, channel_name, rank, summary_snippet, _ in rows:
+        snippet = summary_snippet or transcript_snippets.get(video_id) or ""
+        results.append({
+            "video_id": video_id,
+            "channel_name": channel_name,
+            "title": title or f"Video da {channel_name}",
+            "link": link or f"https://www.youtube.com/watch?v={video_id}",
+            "rank": rank,
+            "source": "summary" if summary_snippet else "transcript",
+            "snippet": " ".join(snippet.split()),
+        })
+    return results, has_more
+
+def format_search_results(query, results, page=1, has_more=False, page_size=SEARCH_PAGE_SIZE):
+    """Compone il testo di una pagina di risultati"""
+    if not results:
+        if page > 1:
+            return f"🔎 Nessun altro risultato per \"{query}\""
+        return f"🔎 Nessun video trovato per \"{query}\""
+
+    lines = [f"🔎 Risultati per \"{query}\" (pagina {page}):"]
+    for index, result in enumerate(results, start=(page - 1) * page_size + 1):
+        source = "📝" if result["source"] == "summary" else "🎙️"
+        lines.append("")
+        lines.append(f"{index}. 🎥 {result['title']} ({result['channel_name']})")
+        if result["snippet"]:
+            lines.append(f"{source} {result['snippet']}")
+        lines.append(f"🔗 {result['link']}")
+    if has_more:
+        lines.append("")
+        lines.append(f"➡️ Pagina successiva: --search \"{query}\" --page {page + 1}")
+    return "\n".join(lines)
@@ -1,23 +1,98 @@
+import queue
+import threading
+from collections import deque
+import time
+from concurrent.futures import Future
 import requests
 from tenacity import retry, stop_after_attempt, wait_exponential
-from config import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
+from config import (TELEGRAM_TOKEN, TELEGRAM_API_URL, TELEGRAM_CHAT_ID, TELEGRAM_TIMEOUT, TELEGRAM_CHAT_RPM,
+                    TELEGRAM_CHAT_BURST, TELEGRAM_GLOBAL_RPM, TELEGRAM_GLOBAL_BURST, TELEGRAM_WORKERS,
+                    TELEGRAM_MAX_MESSAGE_LENGTH)
+from rate_limiter import TokenBucket
+from metrics import timed, telegram_send_seconds, telegram_throttle_seconds, telegram_errors_total
 
 class TelegramError(Exception):
     """Classe base per le eccezioni di Telegram"""
     pass
 
+class TelegramFloodError(TelegramError):
+    """Errore 429 di Telegram: indica quanti secondi attendere prima di riprovare"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Limite di invio superato, riprovare tra {retry_after} secondi")
+        self.retry_after = retry_after
+
+# Sessioni HTTP riutilizzate (una per thread, requests.Session non è thread-safe)
+_thread_local = threading.local()
+
+def _get_session():
+    """Restituisce la sessione HTTP del thread corrente"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
+
+# Limiti di invio: un token bucket per chat e uno globale per il bot, condiviso da tutti i worker
+# (la capacità limitata evita raffiche oltre i 30 messaggi al secondo consentiti da Telegram)
+_chat_buckets = {}
+_global_bucket = TokenBucket(TELEGRAM_GLOBAL_RPM, TELEGRAM_GLOBAL_BURST)
+_buckets_lock = threading.Lock()
+
+def _throttle(chat_id):
+    """Attende il proprio turno secondo i limiti per chat e globali di Telegram"""
+    with _buckets_lock:
+        chat_bucket = _chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = _chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RPM, TELEGRAM_CHAT_BURST)
+        now = time.monotonic()
+        wait = max(chat_bucket.wait_time(1, now), _global_bucket.wait_time(1, now))
+        chat_bucket.consume(1, now)
+        _global_bucket.consume(1, now)
+    telegram_throttle_seconds.observe(wait)
+    if wait > 0:
+        time.sleep(wait)
+
+_exponential_wait = wait_exponential(multiplier=1, min=4, max=10)
+
+def _wait_for_telegram(retry_state):
+    """Attesa tra i tentativi: retry_after per gli errori 429, esponenziale negli altri casi"""
+    error = retry_state.outcome.exception()
+    if isinstance(error, TelegramFloodError):
+        return error.retry_after
+    return _exponential_wait(retry_state)
+
+def split_message(text, limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+    """Divide un testo troppo lungo in parti entro il limite di Telegram.
+
+    Taglia preferibilmente tra paragrafi, poi tra righe e infine tra parole.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
 def check_bot_status():
     """Verifica lo stato del bot e le sue autorizzazioni"""
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getMe"
-        response = requests.get(url)
+        url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/getMe"
+        response = _get_session().get(url, timeout=TELEGRAM_TIMEOUT)
         if not response.ok:
             raise TelegramError(f"Errore nella verifica del bot: {response.text}")
         print("✅ Bot Telegram verificato correttamente")
         
         # Verifica il canale
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getChat"
-        response = requests.post(url, data={"chat_id": TELEGRAM_CHAT_ID})
+        url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/getChat"
+        response = _get_session().post(url, data={"chat_id": TELEGRAM_CHAT_ID}, timeout=TELEGRAM_TIMEOUT)
         if not response.ok:
             raise TelegramError(
                 f"Errore nella verifica del canale: {response.text}\n"
@@ -34,50 +109,147 @@ def check_bot_status():
         print(f"❌ Errore nella verifica delle credenziali Telegram: {str(e)}")
         return False
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def send_message_to_channel(text):
-    """Invia un messaggio al canale Telegram con retry"""
+@retry(stop=stop_after_attempt(5), wait=_wait_for_telegram)
+def _send_part(text, chat_id):
+    """Invia un singolo messaggio (entro il limite di lunghezza) con retry"""
+    _throttle(chat_id)
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        response = requests.post(url, data={"chat_id": TELEGRAM_CHAT_ID, "text": text})
+        url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
+        response = _get_session().post(url, data={"chat_id": chat_id, "text": text},
+                                       timeout=TELEGRAM_TIMEOUT)
+
+        if response.status_code == 429:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 5)
+            print(f"⏳ Limite di invio Telegram raggiunto, attendo {retry_after} secondi...")
+            telegram_errors_total.inc(kind="flood")
+            raise TelegramFloodError(retry_after)
         
         if not response.ok:
             error_msg = f"Errore nell'invio del messaggio: {response.text}"
             if "chat not found" in response.text.lower():
-                error_msg += f"\nChat ID utilizzato: {TELEGRAM_CHAT_ID}"
+                error_msg += f"\nChat ID utilizzato: {chat_id}"
                 error_msg += "\nAssicurati che:\n1. Il bot sia stato aggiunto al canale\n2. Il bot sia amministratore del canale"
+            telegram_errors_total.inc(kind="api")
             raise TelegramError(error_msg)
         
         return response.json()
+    except TelegramError:
+        raise
     except requests.RequestException as e:
         print(f"❌ Errore di rete nell'invio del messaggio Telegram: {str(e)}")
+        telegram_errors_total.inc(kind="network")
         raise TelegramError(f"Errore di rete: {str(e)}")
     except Exception as e:
         print(f"❌ Errore generico nell'invio del messaggio Telegram: {str(e)}")
         raise TelegramError(f"Errore generico: {str(e)}")
 
-def process_new_video(video_info, transcript=None, summary=None):
-    """Processa un nuovo video e invia le notifiche appropriate"""
-    try:
-        # Notifica nuovo video
-        video_message = (
-            f"📢 Nuovo video pubblicato da {video_info['channel_name']}!\n"
-            f"🎥 {video_info['title']}\n"
-            f"🔗 {video_info['link']}"
-        )
-        send_message_to_channel(video_message)
-
-        # Se abbiamo un riassunto, invialo
-        if summary:
-            send_message_to_channel(summary)
-        elif transcript is None:
-            error_msg = f"❌ Riassunto non disponibile per il video: {video_info['title']}"
-            send_message_to_channel(error_msg)
-            print(f"⏩ Saltato il riassunto per {video_info['title']} (trascrizione non disponibile)")
-    
-    except TelegramError as e:
-        print(f"❌ Errore nell'invio delle notifiche Telegram: {str(e)}")
-        # Non rilanciamo l'errore per permettere al programma di continuare
-    except Exception as e:
-        print(f"❌ Errore generico nel processing del video: {str(e)}")
-        # Non rilanciamo l'errore per permettere al programma di continuare 
\ No newline at end of file
+@timed(telegram_send_seconds)
+def send_message_to_channel(text, chat_id=None):
+    """Invia un messaggio al canale Telegram, diviso in più parti se supera i 4096 caratteri"""
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    result = None
+    for part in split_message(text):
+        result = _send_part(part, chat_id)
+    return result
+
+class TelegramOutbox:
+    """Coda dei messaggi in uscita.
+
+    Un numero fisso di worker serve tutte le chat: ogni chat ha la propria coda di gruppi di
+    messaggi (es. notifica e riassunto di un video), servita da un solo worker alla volta così
+    l'ordine è rispettato, mentre chat diverse procedono in parallelo entro i limiti di Telegram.
+    I thread non crescono con il numero di iscritti.
+    """
+
+    def __init__(self, workers=TELEGRAM_WORKERS):
+        self.size = max(1, workers)
+        self.pending = {}  # chat -> gruppi in attesa; presente finché la chat è in coda o in invio
+        self.ready = queue.Queue()  # Chat con gruppi da inviare, servite a turno
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def _start_workers(self):
+        for index in range(self.size - len(self.workers)):
+            worker = threading.Thread(target=self._run, name=f"telegram-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, messages, chat_id=None, on_sent=None):
+        """Accoda un gruppo di messaggi da inviare in ordine alla stessa chat.
+
+        on_sent(indice) viene chiamata dopo ogni messaggio inviato. Restituisce un Future
+        completato al termine del gruppo (con l'eccezione se un invio è fallito).
+        """
+        chat_id = chat_id or TELEGRAM_CHAT_ID
+        future = Future()
+        with self.lock:
+            if not self.workers:
+                self._start_workers()
+            groups = self.pending.get(chat_id)
+            if groups is None:
+                groups = self.pending[chat_id] = deque()
+                self.ready.put(chat_id)
+            groups.append((list(messages), on_sent, future))
+        return future
+
+    def _send_group(self, chat_id, messages, on_sent, future):
+        try:
+            for index, message in enumerate(messages):
+                send_message_to_channel(message, chat_id)
+                if on_sent:
+                    on_sent(index)
+            future.set_result(True)
+        except TelegramError as e:
+            # I messaggi successivi del gruppo non vengono inviati per non alterarne l'ordine
+            print(f"❌ Errore nell'invio delle notifiche Telegram: {str(e)}")
+            future.set_exception(e)
+        except Exception as e:
+            print(f"❌ Errore generico nell'invio delle notifiche Telegram: {str(e)}")
+            future.set_exception(e)
+
+    def _run(self):
+        while True:
+            chat_id = self.ready.get()
+            try:
+                if chat_id is None:
+                    return
+                with self.lock:
+                    group = self.pending[chat_id].popleft()
+                self._send_group(chat_id, *group)
+                with self.lock:
+                    # La chat torna in fondo alla coda se ha altri gruppi: nessuna chat monopolizza i worker
+                    if self.pending[chat_id]:
+                        self.ready.put(chat_id)
+                    else:
+                        del self.pending[chat_id]
+            finally:
+                self.ready.task_done()
+
+    def flush(self):
+        """Attende l'invio di tutti i messaggi accodati"""
+        self.ready.join()
+
+    def stop(self):
+        """Invia i messaggi rimasti e arresta i worker"""
+        self.flush()
+        with self.lock:
+            workers, self.workers = self.workers, []
+            for _ in workers:
+                self.ready.put(None)
+        for worker in workers:
+            worker.join()
+
+# Coda condivisa dei messaggi in uscita
+outbox = TelegramOutbox()
+
+def format_video_message(video_info):
+    """Compone il messaggio di notifica di un nuovo video"""
+    return (
+        f"📢 Nuovo video pubblicato da {video_info['channel_name']}!\n"
+        f"🎥 {video_info['title']}\n"
+        f"🔗 {video_info['link']}"
+    )
+
+def format_missing_summary_message(video_info):
+    """Compone il messaggio inviato quando il riassunto non è disponibile"""
+    return f"❌ Riassunto non disponibile per il video: {video_info['title']}"
@@ -1,20 +1,132 @@
+import calendar
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
 import feedparser
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
-from youtube_transcript_api.formatters import TextFormatter
+import requests
 from tenacity import retry, stop_after_attempt, wait_exponential
-from config import CHANNELS
-from db_operations import get_last_video_id, update_last_video_id
+from config import (CHANNELS, YOUTUBE_FEED_URL, YOUTUBE_WATCH_URL, POLL_MAX_WORKERS, POLL_PER_HOST_LIMIT,
+                    POLL_DEADLINE, FEED_TIMEOUT, TRANSCRIPT_LANGUAGES, TRANSCRIPT_WORKERS)
+from db_operations import get_seen_video_ids, mark_videos_seen, get_feed_states, save_feed_states
+from metrics import timed, rss_fetch_seconds, rss_feeds_total, transcript_fetch_seconds, transcripts_total
 
 class YouTubeError(Exception):
     """Classe base per le eccezioni di YouTube"""
     pass
 
+# Semafori per limitare le richieste contemporanee verso lo stesso host
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+@contextmanager
+def _host_slot(url):
+    """Occupa uno slot di concorrenza per l'host dell'URL indicato"""
+    host = urlparse(url).hostname
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.setdefault(host, threading.BoundedSemaphore(POLL_PER_HOST_LIMIT))
+    with semaphore:
+        yield
+
+# Sessioni HTTP riutilizzate (una per thread, requests.Session non è thread-safe)
+_thread_local = threading.local()
+
+def _get_session():
+    """Restituisce la sessione HTTP del thread corrente"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
+
+# Stato HTTP dei feed: confermato (già salvato) e in attesa di conferma dopo il polling
+_feed_states = None
+_pending_feed_states = {}
+_feed_states_lock = threading.Lock()
+
+# Contatori dei feed saltati (304 o contenuto invariato) e di quelli effettivamente analizzati
+feed_stats = {"not_modified": 0, "unchanged": 0, "parsed": 0}
+
+def _count_feed(outcome):
+    with _feed_states_lock:
+        feed_stats[outcome] += 1
+    rss_feeds_total.inc(result=outcome)
+
+def get_feed_stats():
+    """Restituisce i contatori dei feed saltati e analizzati"""
+    with _feed_states_lock:
+        stats = dict(feed_stats)
+    stats["skipped"] = stats["not_modified"] + stats["unchanged"]
+    return stats
+
+def _get_feed_state(channel_id):
+    """Restituisce lo stato HTTP noto del feed, caricandolo dal database al primo uso"""
+    global _feed_states
+    with _feed_states_lock:
+        if _feed_states is None:
+            _feed_states = get_feed_states()
+        return _feed_states.get(channel_id, {})
+
+def _stage_feed_state(channel_id, state):
+    with _feed_states_lock:
+        _pending_feed_states[channel_id] = state
+
+def commit_feed_states(channel_ids):
+    """Conferma lo stato HTTP dei feed elaborati con successo e lo salva nel database.
+
+    Lo stato viene confermato solo dopo l'elaborazione del canale: se questa fallisce,
+    il feed verrà riscaricato e analizzato al prossimo ciclo.
+    """
+    with _feed_states_lock:
+        committed = {
+            channel_id: _pending_feed_states.pop(channel_id)
+            for channel_id in channel_ids if channel_id in _pending_feed_states
+        }
+        if _feed_states is not None:
+            _feed_states.update(committed)
+    save_feed_states(committed)
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+@timed(rss_fetch_seconds)
 def get_latest_videos(channel_id):
-    """Recupera gli ultimi video pubblicati tramite RSS con retry"""
+    """Recupera gli ultimi video pubblicati tramite RSS con retry.
+
+    Usa richieste condizionali (ETag/Last-Modified) e l'hash del contenuto: se il feed
+    non è cambiato dall'ultimo polling restituisce None senza analizzarlo.
+    """
     try:
-        url = f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
-        feed = feedparser.parse(url)
+        url = f"{YOUTUBE_FEED_URL}?channel_id={channel_id}"
+        state = _get_feed_state(channel_id)
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+        with _host_slot(url):
+            response = _get_session().get(url, headers=headers, timeout=FEED_TIMEOUT)
+
+        if response.status_code == 304:
+            _count_feed("not_modified")
+            return None
+        response.raise_for_status()
+
+        new_state = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": hashlib.sha256(response.content).hexdigest()
+        }
+        if new_state["content_hash"] == state.get("content_hash"):
+            # Contenuto identico: aggiorna solo gli header per le prossime richieste
+            if new_state != state:
+                _stage_feed_state(channel_id, new_state)
+            _count_feed("unchanged")
+            return None
+
+        # feedparser cerca gli header in minuscolo (es. content-type) in un dizionario normale
+        headers = {name.lower(): value for name, value in response.headers.items()}
+        feed = feedparser.parse(response.content, response_headers=headers)
         
         if feed.bozo:  # Controlla se ci sono errori nel feed
             raise YouTubeError(f"Errore nel parsing del feed RSS: {feed.bozo_exception}")
@@ -29,72 +141,299 @@ def get_latest_videos(channel_id):
                 videos.append({
                     "title": entry.title,
                     "link": entry.link,
-                    "published": entry.published,
+                    "published": _published_at(entry),
                     "video_id": video_id,
                     "channel_name": channel_name
                 })
+        _stage_feed_state(channel_id, new_state)
+        _count_feed("parsed")
         return videos
     except Exception as e:
         print(f"❌ Errore nel recupero dei video dal canale {channel_id}: {str(e)}")
+        rss_feeds_total.inc(result="error")
         raise YouTubeError(f"Errore nel recupero dei video: {str(e)}")
 
-def poll_channels(channels=CHANNELS):
-    """Controlla per nuovi video sui canali"""
+def _published_at(entry):
+    """Data di pubblicazione della voce del feed in formato ISO (UTC), None se assente o non valida.
+
+    Si usa la data già interpretata da feedparser: una stringa malformata non deve arrivare al database.
+    """
+    parsed = getattr(entry, 'published_parsed', None)
+    if not parsed:
+        return None
+    try:
+        return datetime.fromtimestamp(calendar.timegm(parsed), tz=timezone.utc).isoformat()
+    except (OverflowError, ValueError, TypeError):
+        return None
+
+def _channel_pairs(channels):
+    """Accetta un dizionario nome -> id (come CHANNELS) o una lista di coppie (nome, id)"""
+    return channels.items() if isinstance(channels, dict) else channels
+
+def fetch_channels(channels=CHANNELS, max_workers=POLL_MAX_WORKERS, deadline=POLL_DEADLINE):
+    """Scarica in parallelo i feed dei canali entro una scadenza globale.
+
+    Restituisce un dizionario channel_id -> {"channel_name", "videos", "error"}: un canale
+    lento o in errore non blocca gli altri e l'errore viene riportato nel suo risultato.
+    """
+    results = {
+        channel_id: {"channel_name": channel_name, "videos": None, "error": None}
+        for channel_name, channel_id in _channel_pairs(channels)
+    }
+    if not results:
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(results))),
+                                  thread_name_prefix="rss")
+    futures = {executor.submit(get_latest_videos, channel_id): channel_id for channel_id in results}
+    done, not_done = wait(futures, timeout=deadline)
+
+    for future in done:
+        channel_id = futures[future]
+        try:
+            results[channel_id]["videos"] = future.result()
+        except Exception as e:
+            results[channel_id]["error"] = e
+
+    for future in not_done:
+        results[futures[future]]["error"] = YouTubeError(f"Scadenza di {deadline}s superata")
+
+    # Non attende i feed ancora in corso: i loro risultati vengono scartati
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+# Cache in memoria dei video già visti per canale (limitata alle voci dell'ultimo feed)
+_seen_cache = {}
+_seen_cache_lock = threading.Lock()
+
+def _detect_new_videos(config_channel_name, channel_id, videos):
+    """Confronta l'intero feed con i video già visti e restituisce tutti i nuovi video.
+
+    Per un canale con una cronologia tutti i video non ancora visti vengono segnalati, anche
+    se compaiono sotto un video già visto (premiere programmata prima, video reso pubblico in
+    ritardo). Al primo polling di un canale senza cronologia viene segnalato solo l'ultimo
+    video e gli altri vengono solo registrati come visti. Un video già visto che cambia
+    posizione nel feed (premiere, riordino) non viene segnalato di nuovo.
+    """
+    if not videos:
+        # Feed vuoto o invariato dall'ultimo polling: nessun accesso al database
+        return []
+
+    video_ids = [video["video_id"] for video in videos]
+    # Usa il nome del canale dal feed se disponibile, altrimenti usa quello dalla configurazione
+    actual_channel_name = videos[0].get("channel_name") or config_channel_name
+    with _seen_cache_lock:
+        seen = set(_seen_cache.get(channel_id, ()))
+    has_history = bool(seen)
+
+    unknown_ids = [video_id for video_id in video_ids if video_id not in seen]
+    if not unknown_ids:
+        return []
+
+    # Verifica nel database solo i video assenti dalla cache
+    db_has_history, db_seen = get_seen_video_ids(channel_id, unknown_ids)
+    has_history = has_history or db_has_history
+    seen |= db_seen
+
+    unseen = [video for video in videos if video["video_id"] not in seen]
+    if unseen:
+        # Canale mai visto: solo l'ultimo video, come in precedenza
+        to_emit = unseen if has_history else videos[:1]
+        emitted_ids = {video["video_id"] for video in to_emit}
+        mark_videos_seen(
+            channel_id,
+            actual_channel_name,
+            [(video, video["video_id"] in emitted_ids) for video in unseen]
+        )
+    else:
+        to_emit = []
+
+    with _seen_cache_lock:
+        _seen_cache[channel_id] = set(video_ids)
+
+    # Dal più vecchio al più recente, per notificare in ordine cronologico
+    return [{
+        "channel_name": actual_channel_name,
+        "channel_id": channel_id,
+        **video
+    } for video in reversed(to_emit)]
+
+def poll_channels(channels=CHANNELS, failed_channels=None):
+    """Controlla per nuovi video sui canali.
+
+    Se viene passata la lista failed_channels, vi vengono aggiunti gli id dei canali in errore.
+    """
+    if failed_channels is None:
+        failed_channels = []
     new_videos = []
-    for config_channel_name, channel_id in channels.items():
+    processed_channels = []
+
+    if POLL_MAX_WORKERS > 1:
+        # Scarica tutti i feed in parallelo, poi confronta i risultati con il database
+        results = fetch_channels(channels)
+        for channel_id, result in results.items():
+            if result["error"] is not None:
+                print(f"❌ Errore nel polling del canale {result['channel_name']}: {str(result['error'])}")
+                failed_channels.append(channel_id)
+                continue
+            try:
+                new_videos.extend(_detect_new_videos(result["channel_name"], channel_id, result["videos"]))
+                processed_channels.append(channel_id)
+            except Exception as e:
+                print(f"❌ Errore nel polling del canale {result['channel_name']}: {str(e)}")
+                failed_channels.append(channel_id)
+        commit_feed_states(processed_channels)
+        return new_videos
+
+    for config_channel_name, channel_id in _channel_pairs(channels):
         try:
-            last_known_video = get_last_video_id(channel_id)
             videos = get_latest_videos(channel_id)
-            
-            if videos:
-                latest_video = videos[0]
-                latest_video_id = latest_video["video_id"]
-                # Usa il nome del canale dal feed se disponibile, altrimenti usa quello dalla configurazione
-                actual_channel_name = latest_video.get("channel_name") or config_channel_name
-                
-                if last_known_video != latest_video_id:
-                    update_last_video_id(channel_id, latest_video_id, actual_channel_name)
-                    new_videos.append({
-                        "channel_name": actual_channel_name,
-                        "channel_id": channel_id,
-                        **latest_video
-                    })
+            new_videos.extend(_detect_new_videos(config_channel_name, channel_id, videos))
+            processed_channels.append(channel_id)
         except Exception as e:
             print(f"❌ Errore nel polling del canale {config_channel_name}: {str(e)}")
+            failed_channels.append(channel_id)
             continue  # Continua con il prossimo canale in caso di errore
     
+    commit_feed_states(processed_channels)
     return new_videos
 
-def try_get_transcript_with_lang(video_id, lang):
-    """Prova a ottenere la trascrizione in una specifica lingua"""
+# Stati di un video rilevati dalla pagina di YouTube (None = video normale)
+LIVE_UPCOMING = "upcoming"
+LIVE_STREAM = "live"
+
+@retry(stop=stop_after_attempt(2), wait=wait_exponential(multiplier=1, min=2, max=5))
+def get_live_status(video_id):
+    """Indica se il video è una diretta o una première (programmata, in corso o appena conclusa).
+
+    Le API delle trascrizioni non distinguono una diretta da un video senza sottotitoli:
+    lo stato viene letto dai dati del player nella pagina del video.
+    """
+    url = f"{YOUTUBE_WATCH_URL}?v={video_id}"
+    try:
+        with _host_slot(url):
+            response = _get_session().get(url, timeout=FEED_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise YouTubeError(f"Errore nel recupero della pagina del video {video_id}: {str(e)}")
+
+    page = response.text
+    if '"videoDetails"' not in page:
+        # Pagina di consenso o di errore: lo stato non è verificabile
+        raise YouTubeError(f"Dati del player non presenti nella pagina del video {video_id}")
+    if '"isUpcoming":true' in page:
+        return LIVE_UPCOMING
+    if '"isLiveContent":true' in page or '"liveBroadcastDetails"' in page:
+        return LIVE_STREAM
+    return None
+
+def select_transcript(transcript_list, languages):
+    """Sceglie la traccia migliore da un unico elenco delle trascrizioni disponibili.
+
+    Segue l'ordine di preferenza delle lingue preferendo, per ogni lingua, la trascrizione
+    manuale a quella generata automaticamente; in mancanza di entrambe traduce una traccia
+    disponibile nella prima lingua preferita. Restituisce (traccia, lingua, è_traduzione).
+    """
+    from youtube_transcript_api import NoTranscriptFound
+
+    for lang in languages:
+        for finder in (transcript_list.find_manually_created_transcript,
+                       transcript_list.find_generated_transcript):
+            try:
+                transcript = finder([lang])
+                return transcript, lang, False
+            except NoTranscriptFound:
+                continue
+
+    # Traduzione come ultima risorsa (prima dalle tracce manuali)
+    candidates = sorted(transcript_list, key=lambda transcript: transcript.is_generated)
+    for transcript in candidates:
+        if transcript.is_translatable and any(
+                language["language_code"] == languages[0] for language in transcript.translation_languages):
+            return transcript.translate(languages[0]), languages[0], True
+    return None, None, False
+
+def _find_transcript(video_id, languages=None):
+    """Elenca una sola volta le tracce del video e sceglie la migliore (traccia, lingua, è_traduzione)"""
+    # Import locale: la libreria serve solo quando c'è un video da trascrivere
+    from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=[lang])
-        print(f"✅ Trascrizione trovata in {lang}")
-        return transcript
+        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+        return select_transcript(transcript_list, languages or TRANSCRIPT_LANGUAGES)
     except (TranscriptsDisabled, NoTranscriptFound):
+        return None, None, False
+
+def _segment_fields(segment):
+    """Restituisce (inizio, testo) di un segmento, sia come dizionario sia come oggetto"""
+    if isinstance(segment, dict):
+        return float(segment["start"]), segment["text"]
+    return float(segment.start), segment.text
+
+@timed(transcript_fetch_seconds)
+def get_transcript_segments(video_id, languages=None):
+    """Scarica i segmenti della trascrizione come lista di (inizio in secondi, testo).
+
+    Usato per le dirette e le première, la cui trascrizione può non esistere ancora o crescere
+    tra un controllo e l'altro. Restituisce None se non è (ancora) disponibile.
+    """
+    transcript, _, _ = _find_transcript(video_id, languages)
+    if transcript is None:
         return None
+    return sorted(_segment_fields(segment) for segment in transcript.fetch())
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def get_transcript(video_id, lang='it'):
-    """Scarica la trascrizione del video con retry e fallback su inglese"""
+@timed(transcript_fetch_seconds)
+def get_transcript(video_id, languages=None):
+    """Scarica la trascrizione del video con retry, scegliendo la lingua da TRANSCRIPT_LANGUAGES.
+
+    Le tracce disponibili vengono elencate una sola volta per video. Restituisce
+    (testo formattato, True se la trascrizione è una traduzione).
+    """
+    from youtube_transcript_api.formatters import TextFormatter
+
     try:
-        # Prima prova in italiano
-        transcript = try_get_transcript_with_lang(video_id, 'it')
-        
-        # Se non trova in italiano, prova in inglese
-        if transcript is None:
-            print("⚠️ Trascrizione in italiano non trovata, provo in inglese...")
-            transcript = try_get_transcript_with_lang(video_id, 'en')
+        transcript, lang, translated = _find_transcript(video_id, languages)
         
         # Se non trova in nessuna lingua
         if transcript is None:
             print(f"❌ Trascrizione non disponibile per il video: https://www.youtube.com/watch?v={video_id}")
+            transcripts_total.inc(result="missing")
             return None, False
+
+        print(f"✅ Trascrizione trovata in {lang}" + (" (traduzione)" if translated else ""))
+        transcripts_total.inc(result="translated" if translated else "found")
         
         # Formatta la trascrizione
         formatter = TextFormatter()
-        return formatter.format_transcript(transcript), False
+        return formatter.format_transcript(transcript.fetch()), translated
         
     except Exception as e:
         print(f"⚠️ Errore nel recuperare la trascrizione per {video_id}: {str(e)}")
-        raise YouTubeError(f"Errore nel recupero della trascrizione: {str(e)}") 
\ No newline at end of file
+        transcripts_total.inc(result="error")
+        raise YouTubeError(f"Errore nel recupero della trascrizione: {str(e)}")
+
+def get_transcripts(video_ids, max_workers=TRANSCRIPT_WORKERS, languages=None):
+    """Scarica in parallelo le trascrizioni di più video.
+
+    languages è un dizionario opzionale video_id -> lingue preferite del canale.
+    Restituisce video_id -> testo (None se non disponibile); i video in errore non
+    compaiono nel risultato e un video che fallisce non interrompe gli altri.
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    if not video_ids:
+        return {}
+
+    _failed = object()
+
+    def fetch(video_id):
+        try:
+            return get_transcript(video_id, (languages or {}).get(video_id))[0]
+        except Exception as e:
+            print(f"❌ Errore nel recupero della trascrizione per {video_id}: {str(e)}")
+            return _failed
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(video_ids))),
+                            thread_name_prefix="transcript") as executor:
+        results = dict(zip(video_ids, executor.map(fetch, video_ids)))
+    return {video_id: text for video_id, text in results.items() if text is not _failed}